@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import itertools
+import time
+import timeit
+from multiprocessing.pool import ThreadPool
+
+from backend.apps.auth.models import SecureToken, User
+from backend.apps.document.mail import NotificationRenderer, build_message, get_templates
+from backend.apps.document.models import Document, FileLog
+from backend.apps.document.tokens import resolve_token
+from backend.apps.document.views import DocumentDownloadView, DocumentViewSet
+from django.contrib.auth.models import Group
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext, override_settings
+from guardian.shortcuts import assign_perm
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+# Most queries each hot path may run, whatever the number of users, files and logs.
+QUERY_BUDGETS = {
+    'notify_receiver': 15,
+    'list': 10,
+    'filter': 12,
+    'download': 10,
+    'set_owner_perms': 10,
+}
+
+
+def bench_render(document, recipients, messages=10000, notify_type='document_reminder'):
+    """Time rendering ``messages`` notifications with render_to_string and with NotificationRenderer."""
+    html_template, subject, text_template = document._prepare_notificaiton(notify_type)
+    url = 'http://example.com/#/download/{}/token'.format(document.pk)
+    batch = list(itertools.islice(itertools.cycle(recipients), messages))
+
+    def render_to_string_path():
+        for recipient in batch:
+            context = {
+                'document': document,
+                'recipient': recipient,
+                'document_download_url': url,
+            }
+            message = render_to_string(text_template, context=context)
+            html_message = render_to_string(html_template, context=context)
+            build_message(recipient, subject, message, html_message)
+
+    def renderer_path():
+        get_templates.cache_clear()
+        renderer = NotificationRenderer(subject, text_template, html_template, document=document)
+        for recipient in batch:
+            renderer.render(recipient, document_download_url=url)
+
+    results = {
+        'render_to_string': timeit.timeit(render_to_string_path, number=1),
+        'renderer': timeit.timeit(renderer_path, number=1),
+    }
+    results['speedup'] = results['render_to_string'] / results['renderer']
+    return results
+
+
+def bench_token_resolution(tokens, requests=10000, threads=16):
+    """Resolve ``tokens`` ``requests`` times from ``threads`` threads, uncached then cached."""
+    def uncached(token):
+        try:
+            secure_token = SecureToken.objects.active().get(token=token, category=SecureToken.DOWNLOAD)
+            secure_token.content_object
+        finally:
+            connection.close()
+
+    def cached(token):
+        try:
+            resolve_token(token).content_object
+        finally:
+            connection.close()
+
+    batch = list(itertools.islice(itertools.cycle(tokens), requests))
+    results = {}
+    for name, resolve in (('uncached', uncached), ('cached', cached)):
+        pool = ThreadPool(threads)
+        start = time.time()
+        pool.map(resolve, batch)
+        results[name] = time.time() - start
+        pool.close()
+        pool.join()
+    results['speedup'] = results['uncached'] / results['cached']
+    return results
+
+
+def measure(func, *args, **kwargs):
+    """Run ``func`` once; returns its wall time in seconds and the number of queries it ran."""
+    with CaptureQueriesContext(connection) as queries:
+        start = time.time()
+        func(*args, **kwargs)
+        seconds = time.time() - start
+    return {'seconds': seconds, 'queries': len(queries)}
+
+
+def generate_users(count, prefix='bench'):
+    User.objects.bulk_create(
+        User(username='{}{}'.format(prefix, i), email='{}{}@example.com'.format(prefix, i)) for i in range(count)
+    )
+    return list(User.objects.filter(username__startswith=prefix).order_by('pk'))
+
+
+def generate_files(owner, count, users=(), content=b'%PDF-1.4 benchmark'):
+    """``count`` documents of ``owner`` readable by ``users``, half directly and half through a group."""
+    group, created = Group.objects.get_or_create(name='Benchmark readers')
+    group.user_set.add(*users[1::2])
+    documents = []
+    for i in range(count):
+        document = Document.objects.create(name='benchmark document {}'.format(i), owner=owner, notify=True,
+                                           file=ContentFile(content, name='benchmark{}.pdf'.format(i)))
+        document.log_create(owner)
+        for user in users[::2]:
+            assign_perm('document.view_document', user, document)
+        assign_perm('document.view_document', group, document)
+        documents.append(document)
+    return documents
+
+
+def generate_logs(files, users, count):
+    """``count`` download and notify logs spread over ``files`` and ``users``."""
+    pairs = itertools.cycle(itertools.product(files, users))
+    types = itertools.cycle((FileLog.NOTIFY, FileLog.NOTIFY, FileLog.DOWNLOAD))
+    logs = [FileLog(file=file, user=user, type=next(types)) for file, user in itertools.islice(pairs, count)]
+    for log in logs:
+        log.save()
+    return logs
+
+
+def bench_hot_paths(users=100, files=20, logs=1000):
+    """Wall time and query count of the document hot paths over generated data.
+
+    Run it against a scratch database: the generated rows are left in place.
+    """
+    owner = User.objects.create(username='benchmark-owner', email='benchmark-owner@example.com')
+    readers = generate_users(users)
+    documents = generate_files(owner, files, readers)
+    generate_logs(documents, readers, logs)
+    document, reader = documents[0], readers[0]
+    factory = APIRequestFactory()
+    list_view = DocumentViewSet.as_view({'get': 'list'})
+
+    def request_list(params):
+        request = factory.get('/documents/', params)
+        force_authenticate(request, user=reader)
+        list_view(request).render()
+
+    def download(token):
+        response = DocumentDownloadView.as_view()(factory.get('/download/'), token=token)
+        if response.streaming:
+            b''.join(response.streaming_content)
+
+    results = {}
+    with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+        results['notify_receiver'] = measure(document.notify_receiver, document.DOCUMENT_REMINDER)
+    results['list'] = measure(request_list, {})
+    results['filter'] = measure(request_list, {'search': 'benchmark'})
+    results['download'] = measure(download, document.frontend_download_url(reader).rsplit('/', 1)[-1])
+    results['set_owner_perms'] = measure(documents[-1].set_owner_perms)
+    return results
+
+
+def check_budgets(results, budgets=QUERY_BUDGETS):
+    """Messages for every path of ``results`` running more queries than its budget."""
+    return ['{}: {} queries, budget {}'.format(name, results[name]['queries'], budget)
+            for name, budget in sorted(budgets.items())
+            if name in results and results[name]['queries'] > budget]
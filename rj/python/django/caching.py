@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.encoding import force_bytes
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+VERSION_KEY = 'document-version:{}'
+
+
+def version_cache():
+    """Cache holding the change versions; it must be shared by every worker process."""
+    return caches[getattr(settings, 'DOCUMENT_VERSION_CACHE', 'default')]
+
+
+@checks.register('caches')
+def check_version_cache(app_configs=None, **kwargs):
+    if not isinstance(version_cache(), (LocMemCache, DummyCache)):
+        return []
+    message = 'DOCUMENT_VERSION_CACHE uses a per-process cache backend.'
+    hint = ('Change versions bumped in one worker are not seen by the others, which keep answering '
+            '304 and serving cached pages. Point DOCUMENT_VERSION_CACHE at a shared cache '
+            '(memcached, redis, database).')
+    if settings.DEBUG:
+        return [checks.Warning(message, hint=hint, id='document.W001')]
+    return [checks.Error(message, hint=hint, id='document.E001')]
+
+
+def get_version(category):
+    """Change version of ``category`` as ``(version, timestamp)``; starts a new one when unknown."""
+    version = version_cache().get(VERSION_KEY.format(category))
+    if version is None:
+        version = bump_version(category)
+    return version
+
+
+def bump_version(*categories):
+    """Start a new change version for ``categories``."""
+    now = time.time()
+    version = ('{:.6f}'.format(now), now)
+    version_cache().set_many({VERSION_KEY.format(category): version for category in categories}, None)
+    return version
+
+
+class PageCache(object):
+    """Small thread safe LRU of serialized list pages."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.pages.pop(key, None)
+            if data is not None:
+                self.pages[key] = data
+            return data
+
+    def set(self, key, data):
+        if not self.max_size:
+            return
+        with self.lock:
+            self.pages.pop(key, None)
+            self.pages[key] = data
+            while len(self.pages) > self.max_size:
+                self.pages.popitem(last=False)
+
+
+page_cache = PageCache(getattr(settings, 'DOCUMENT_LIST_CACHE_SIZE', 0))
+
+
+class ConditionalResponseMixin(object):
+    """ETag / Last-Modified for document list and detail responses, with 304 when unchanged.
+
+    Both validators derive from the change version of the viewset's ``category``, bumped on
+    every create, modify, delete and permission change, so nothing is queried to answer a
+    conditional request. Serialized list pages can also be kept in ``page_cache``.
+    """
+    category = None
+
+    def list(self, request, *args, **kwargs):
+        version, modified = get_version(self.category)
+        params = tuple((name, tuple(values)) for name, values in sorted(request.query_params.lists()))
+        key = (request.user.pk, params, version)
+        etag = self.make_etag(key)
+        if self.not_modified(request, etag, modified):
+            return self.not_modified_response(etag, modified)
+
+        data = page_cache.get(key)
+        if data is not None:
+            response = Response(data)
+        else:
+            response = super(ConditionalResponseMixin, self).list(request, *args, **kwargs)
+            page_cache.set(key, response.data)
+        return self.add_validators(response, etag, modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        version, modified = get_version(self.category)
+        etag = self.make_etag((request.user.pk, kwargs.get(self.lookup_url_kwarg or self.lookup_field), version))
+        if self.not_modified(request, etag, modified):
+            return self.not_modified_response(etag, modified)
+        response = super(ConditionalResponseMixin, self).retrieve(request, *args, **kwargs)
+        return self.add_validators(response, etag, modified)
+
+    def make_etag(self, key):
+        return quote_etag(hashlib.md5(force_bytes(repr(key))).hexdigest())
+
+    def not_modified(self, request, etag, modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE') or '')
+        # Last-Modified has whole seconds: a version from the second it names may be newer than
+        # the response that carried it, so only versions from before that second are unchanged.
+        return if_modified_since is not None and modified < if_modified_since
+
+    def not_modified_response(self, etag, modified):
+        return self.add_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, modified)
+
+    def add_validators(self, response, etag, modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        return response
@@ -0,0 +1,17 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save, pre_save
+
+
+class DivisionConfig(AppConfig):
+    name = 'cdo.edu.division'
+
+    def ready(self):
+        from cdo.edu.division import occupancy
+        from cdo.edu.management.models import StudentState
+
+        pre_save.connect(occupancy.remember_state_range, sender=StudentState,
+                         dispatch_uid='division_remember_state_range')
+        post_save.connect(occupancy.update_snapshots_on_save, sender=StudentState,
+                          dispatch_uid='division_update_snapshots_on_save')
+        post_delete.connect(occupancy.update_snapshots_on_delete, sender=StudentState,
+                            dispatch_uid='division_update_snapshots_on_delete')
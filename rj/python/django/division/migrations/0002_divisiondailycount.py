@@ -0,0 +1,25 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('division', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DivisionDailyCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('division', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_counts', to='division.Division')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='divisiondailycount',
+            unique_together=set([('division', 'day')]),
+        ),
+    ]
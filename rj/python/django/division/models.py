@@ -0,0 +1,11 @@
+from django.db import models
+
+
+class DivisionDailyCount(models.Model):
+    """Materialized ``count_series`` rows, kept in step with every ``StudentState`` change."""
+    division = models.ForeignKey('Division', related_name='daily_counts', on_delete=models.CASCADE)
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('division', 'day')
@@ -1,18 +1,37 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+import magic
 from backend.apps.contact.models import Contact
 from backend.apps.auth.models import SecureToken, User
 from backend.apps.document import managers
+from backend.apps.document.caching import bump_version
+from backend.apps.document.instrumentation import add_recipients, instrument
+from backend.apps.document.mail import MailDispatcher, NotificationRenderer, build_message
+from backend.apps.document.permissions import bulk_assign_perms, prefetch_object_perms, rebuild_visibility
+from backend.apps.document.search import get_backend as get_search_backend
+from backend.apps.document.storage import document_storage
+from backend.apps.document.tokens import cache_key as token_cache_key, generation as token_generation
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from django.template.loader import render_to_string
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
-from guardian.shortcuts import assign_perm, get_users_with_perms
+from guardian.models import GroupObjectPermission, UserObjectPermission
 
+logger = logging.getLogger(__name__)
 
 
 @python_2_unicode_compatible
@@ -36,10 +55,13 @@ class File(models.Model):
     DOCUMENT_CHANGED = 'document_changed'
     DOCUMENT_NEW = 'document_new'
 
+    TIMESTAMP_FIELDS = ('created_at', 'modified_at')
+    CONTAINER_MIME_TYPES = ('application/zip', 'application/octet-stream')
+
     name = models.CharField(max_length=255)
     short_description = models.TextField(blank=True)
     description = models.TextField(blank=True)
-    file = models.FileField(blank=True)
+    file = models.FileField(blank=True, storage=document_storage)
     category = models.CharField(max_length=255, choices=CATEGORY_CHOICES)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL)
     is_delete = models.BooleanField(default=False)
@@ -47,6 +69,11 @@ class File(models.Model):
     is_important = models.BooleanField(default=False)
     sticky = models.BooleanField(default=False)
     contacts_to_notify = models.ManyToManyField(Contact, blank=True, null=True)
+    created_at = models.DateTimeField(null=True, editable=False)
+    modified_at = models.DateTimeField(null=True, editable=False)
+    mime_type = models.CharField(max_length=255, blank=True, editable=False)
+    file_size = models.BigIntegerField(null=True, editable=False)
+    checksum = models.CharField(max_length=64, blank=True, editable=False)
 
     objects = managers.FileManager()
     deleted_objects = managers.DeletedFileManager()
@@ -61,23 +88,16 @@ class File(models.Model):
         return self.name
 
     @property
-    def view_access(self):
-        perm = 'view_{}'.format(self.category)
-        return [user for user, perms in get_users_with_perms(self, attach_perms=True).iteritems()
-                if perm in perms and user != self.owner]
+    def object_perms(self):
+        if not hasattr(self, '_object_perms'):
+            prefetch_object_perms([self])
+        return self._object_perms
 
     @property
-    def created_at(self):
-        log = self.logs.get(type=FileLog.CREATE)
-        return log.datetime
-
-    @property
-    def modified_at(self):
-        modify_logs = self.logs.filter(type=FileLog.MODIFY)
-        if modify_logs.exists():
-            return modify_logs.latest('datetime').datetime
-        else:
-            return self.created_at
+    def view_access(self):
+        perm = 'view_{}'.format(self.category)
+        return [user for user, perms in self.object_perms.items()
+                if perm in perms and user.pk != self.owner_id]
 
     @property
     def filename(self):
@@ -85,7 +105,55 @@ class File(models.Model):
 
     @property
     def size(self):
-        return self.file.size if self.file else 0
+        if not self.file:
+            return 0
+        return self.file_size if self.file_size is not None else self.file.size
+
+    def save(self, *args, **kwargs):
+        if not self.file:
+            self.mime_type, self.file_size, self.checksum = '', None, ''
+        elif not self.file._committed:
+            # Files stored before the metadata existed are filled in by backfill_file_metadata.
+            self.extract_file_metadata()
+        if not self._state.adding and not args and kwargs.get('update_fields') is None:
+            # The timestamps are written by _touch alone, so a stale instance cannot roll them back.
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.TIMESTAMP_FIELDS]
+        super(File, self).save(*args, **kwargs)
+
+    def extract_file_metadata(self):
+        """Compute MIME type, size and SHA-256 checksum in one streaming pass over the file."""
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+        for chunk in self.file.chunks():
+            if not head:
+                head = chunk
+            digest.update(chunk)
+            size += len(chunk)
+        self.mime_type = magic.from_buffer(head, mime=True) if head else ''
+        if self.mime_type in self.CONTAINER_MIME_TYPES:
+            # Office documents are zip files told apart by entries that may lie past the first chunk.
+            path = self._local_path()
+            if path:
+                self.mime_type = magic.from_file(path, mime=True)
+        if self.file._committed:
+            self.file.close()
+        self.file_size = size
+        self.checksum = digest.hexdigest()
+        if not self.file._committed:
+            # Lets the content-addressed storage skip hashing the upload a second time.
+            self.file.file.sha256 = self.checksum
+
+    def _local_path(self):
+        """Path of the file on the local file system, if it has one."""
+        if not self.file._committed:
+            temporary_file_path = getattr(self.file.file, 'temporary_file_path', None)
+            return temporary_file_path() if temporary_file_path else None
+        try:
+            return self.file.path
+        except NotImplementedError:
+            return None
 
     def delete(self, using=None, keep_parents=False):
         delete_log = self.logs.filter(type=FileLog.DELETE)
@@ -116,27 +184,40 @@ class File(models.Model):
         self.__log(user, type=FileLog.DELETE)
 
     def set_owner_perms(self, model=None):
-        assign_perm('document.view_file', self.owner, self)
-        assign_perm('document.delete_file', self.owner, self)
-        assign_perm('document.change_file', self.owner, self)
-        if model:
-            assign_perm('document.view_{}'.format(model), self.owner, self)
-            assign_perm('document.delete_{}'.format(model), self.owner, self)
-            assign_perm('document.change_{}'.format(model), self.owner, self)
+        bulk_assign_perms([self], model=model)
 
     def frontend_download_url(self, user):
-        token, created = SecureToken.objects.active().get_or_create(
-            user=user,
-            content_type=ContentType.objects.get_for_model(self),
+        return self.download_urls([user])[user]
+
+    def download_urls(self, users):
+        """Map each user to a download link, issuing missing tokens with a single bulk insert."""
+        users = set(users)
+        if not users:
+            return {}
+        content_type = ContentType.objects.get_for_model(self)
+        tokens = {}
+        for token in SecureToken.objects.active().filter(
+            user__in=users,
+            content_type=content_type,
             object_id=self.id,
             category=SecureToken.DOWNLOAD
-        )
-        return 'http://{domain}/#/download/{id}/{token}'.format(
-                    domain=Site.objects.first().domain,
+        ):
+            tokens.setdefault(token.user_id, token)
+
+        missing = [SecureToken(user=user, content_type=content_type, object_id=self.id,
+                               category=SecureToken.DOWNLOAD)
+                   for user in users if user.pk not in tokens]
+        SecureToken.objects.bulk_create(missing)
+        tokens.update((token.user_id, token) for token in missing)
+
+        domain = Site.objects.first().domain
+        return {user: 'http://{domain}/#/download/{id}/{token}'.format(
+                    domain=domain,
                     id=self.pk,
-                    token=token.token,
-                )
+                    token=tokens[user.pk].token,
+                ) for user in users}
 
+    @instrument('document.notify_contacts')
     def notify_contacts(self, notify_type='document_reminder'):
         html_template, subject, text_template = self._prepare_notificaiton(notify_type)
 
@@ -146,16 +227,12 @@ class File(models.Model):
         ]):
             return
 
-        for contact in self.contacts_to_notify.all():
-            context = {
-                'document': self,
-                'recipient': contact,
-                'document_download_url': self.frontend_download_url(contact.owner),
-            }
-            message = render_to_string(text_template, context=context)
-            html_message = render_to_string(html_template, context=context)
-            contact.email_user(subject, message, html_message=html_message)
+        contacts = self.contacts_to_notify.select_related('owner')
+        urls = self.download_urls(contact.owner for contact in contacts)
+        contacts_to_notify = {contact: urls[contact.owner] for contact in contacts}
+        self._send_notifications(subject, text_template, html_template, contacts_to_notify)
 
+    @instrument('document.notify_receiver')
     def notify_receiver(self, notify_type='document_reminder', notify_count=5):
         html_template, subject, text_template = self._prepare_notificaiton(notify_type)
 
@@ -165,28 +242,14 @@ class File(models.Model):
         ]):
             return
 
-        users_to_notify = {}
-        for user, perms in get_users_with_perms(self, attach_perms=True).iteritems():
-            if all([
-                'view_document' in perms,
-                not user.is_superuser,
-                user != self.owner,
-                not self.logs.filter(file=self, user=user, type=FileLog.DOWNLOAD).exists(),
-                notify_type != 'document_reminder' or self.logs.filter(user=user, type=FileLog.NOTIFY).count() <= notify_count
-            ]):
-                users_to_notify[user] = {
-                    'document': self,
-                    'recipient': user,
-                    'document_download_url': self.frontend_download_url(user),
-                }
-
-        for user, context in users_to_notify.items():
-            message = render_to_string(text_template, context=context)
-            html_message = render_to_string(html_template, context=context)
-            user.email_user(subject, message, html_message=html_message)
-            self.log_notify(user)
-
+        count = notify_count if notify_type == 'document_reminder' else None
+        users = self.get_recipients(perm='view_document', notify_count=count)
+        users_to_notify = self.download_urls(users)
+        with FileLogWriter.buffered():
+            for user in self._send_notifications(subject, text_template, html_template, users_to_notify):
+                self.log_notify(user)
 
+    @instrument('document.notify_users')
     def notify_users(self, notify_type='document_reminder'):
         html_template, subject, text_template = self._prepare_notificaiton(notify_type)
 
@@ -196,31 +259,16 @@ class File(models.Model):
         ]):
             return
 
-        users_to_notify = {}
-        for user, perms in get_users_with_perms(self, attach_perms=True).iteritems():
-            if all([
-                'view_document' in perms,
-                not user.is_superuser,
-                user != self.owner,
-                not self.logs.filter(file=self, user=user, type=FileLog.DOWNLOAD).exists()
-            ]):
-                users_to_notify[user] = {
-                    'document': self,
-                    'recipient': user,
-                    'document_download_url': self.frontend_download_url(user),
-                }
-                users_to_notify.update({contact: {
-                    'document': self,
-                    'recipient': contact,
-                    'document_download_url': self.frontend_download_url(contact.owner),
-                    } for contact in user.contact_set.all()
-                })
+        users = self.get_recipients(perm='view_document', prefetch=('contact_set__owner',))
+        urls = self.download_urls(users + [contact.owner for user in users for contact in user.contact_set.all()])
+        users_to_notify = {user: urls[user] for user in users}
+        users_to_notify.update({contact: urls[contact.owner] for user in users for contact in user.contact_set.all()})
+        delivered = self._send_notifications(subject, text_template, html_template, users_to_notify)
+        with FileLogWriter.buffered():
+            for user in set(users).intersection(delivered):
                 self.log_notify(user)
-        for user, context in users_to_notify.items():
-            message = render_to_string(text_template, context=context)
-            html_message = render_to_string(html_template, context=context)
-            user.email_user(subject, message, html_message=html_message)
 
+    @instrument('document.notify_members')
     def notify_members(self, notify_type='post_reminder'):
         html_template, subject, text_template = self._prepare_notificaiton(notify_type)
 
@@ -230,38 +278,18 @@ class File(models.Model):
         ]):
             return
 
-        users_to_notify = {}
-        members = User.objects.filter(groups__name='Members')
-        for member in members:
-            if all([
-                not member.is_superuser,
-                member != self.owner,
-                not self.logs.filter(file=self, user=member, type=FileLog.DOWNLOAD).exists()
-            ]):
-                users_to_notify[member] = {
-                    'document': self,
-                    'recipient': member,
-                    'document_download_url': self.frontend_download_url(member),
-                }
+        members = self.get_recipients(members=True)
+        users_to_notify = self.download_urls(members)
+        with FileLogWriter.buffered():
+            for member in self._send_notifications(subject, text_template, html_template, users_to_notify):
                 self.log_notify(member)
 
-        for user, context in users_to_notify.items():
-            message = render_to_string(text_template, context=context)
-            html_message = render_to_string(html_template, context=context)
-            user.email_user(subject, message, html_message=html_message)
-
+    @instrument('document.notify_owner')
     def notify_owner(self, notify_count=5):
         """Notify owner that users with view permission doesn't download document after 5 notifications"""
         if not self.notify:
             return
-        users = [user for user, perms in get_users_with_perms(self, attach_perms=True).iteritems()
-                 if all([
-                    'view_document' in perms,
-                    not user.is_superuser,
-                    user != self.owner,
-                    self.logs.filter(user=user, type=FileLog.NOTIFY).count() <= notify_count,
-                    not self.logs.filter(file=self, user=user, type=FileLog.DOWNLOAD).exists()
-                    ])]
+        users = self.get_recipients(perm='view_document', notify_count=notify_count)
 
         if not users:
             return
@@ -273,12 +301,79 @@ class File(models.Model):
         subject = '[ACWL] Document not downloaded'
         message = render_to_string('email/notifications/document_not_downloaded.txt', context=context)
         html_message = render_to_string('email/notifications/document_not_downloaded.html', context=context)
-        self.log_notify(self.owner)
-        self.owner.email_user(subject, message, html_message=html_message)
-
+        add_recipients(1)
+        if MailDispatcher().send([(self.owner, build_message(self.owner, subject, message, html_message))]):
+            self.log_notify(self.owner)
+
+    def enqueue_notification(self, method, notify_type=''):
+        return NotificationJob.enqueue(self, method, notify_type)
+
+    def get_recipients(self, perm=None, notify_count=None, members=False, prefetch=()):
+        """Users eligible for a notification, resolved in a single query.
+
+        Candidates are users holding ``perm`` on this file (directly or through a group), or
+        every user of the ``Members`` group when ``members`` is set. Superusers, the owner and
+        users who already downloaded the file are skipped, as are users notified more than
+        ``notify_count`` times when it is given. Download and notify history is read from
+        ``FileLogCounter`` rather than from the log itself.
+        """
+        if members:
+            users = User.objects.filter(groups__name='Members')
+        else:
+            users = self._users_with_perm(perm)
+        counters = FileLogCounter.objects.filter(file_id=self.pk)
+        users = users.exclude(pk__in=counters.filter(type=FileLog.DOWNLOAD).values('user_id'))
+        if notify_count is not None:
+            users = users.exclude(
+                pk__in=counters.filter(type=FileLog.NOTIFY, count__gt=notify_count).values('user_id')
+            )
+        users = users.exclude(is_superuser=True).exclude(pk=self.owner_id).distinct()
+        if prefetch:
+            users = users.prefetch_related(*prefetch)
+        return list(users)
+
+    def _users_with_perm(self, perm):
+        if hasattr(self, '_object_perms'):
+            return User.objects.filter(pk__in=[user.pk for user, perms in self._object_perms.items() if perm in perms])
+        content_type = ContentType.objects.get_for_model(self)
+        object_pk = str(self.pk)
+        user_perms = UserObjectPermission.objects.filter(
+            content_type=content_type, object_pk=object_pk, permission__codename=perm,
+        ).values('user_id')
+        group_perms = GroupObjectPermission.objects.filter(
+            content_type=content_type, object_pk=object_pk, permission__codename=perm,
+        ).values('group_id')
+        return User.objects.filter(Q(pk__in=user_perms) | Q(groups__in=group_perms))
+
+    def _send_notifications(self, subject, text_template, html_template, download_urls):
+        """Render and send one message per recipient in ``download_urls``; return the delivered ones."""
+        renderer = NotificationRenderer(subject, text_template, html_template, document=self)
+        messages = [(recipient, renderer.render(recipient, document_download_url=url))
+                    for recipient, url in download_urls.items()]
+        add_recipients(len(messages))
+        return MailDispatcher().send(messages)
+
+    @instrument('document.log')
     def __log(self, user=None, type=None):
-        log = FileLog(user=user, type=type, file=File.objects.get(id=self.id))
-        log.save()
+        log = FileLog(user=user, type=type, file=self)
+        if type in FileLogWriter.BUFFERED_TYPES:
+            FileLogWriter.write(log)
+        else:
+            log.save()
+            self._touch(log)
+            bump_version(self.category)
+
+    def _touch(self, log):
+        """Keep the denormalized created_at / modified_at in step with create and modify logs."""
+        if log.type == FileLog.CREATE:
+            timestamps = {'created_at': log.datetime, 'modified_at': log.datetime}
+        elif log.type == FileLog.MODIFY:
+            timestamps = {'modified_at': log.datetime}
+        else:
+            return
+        File.all_objects.filter(pk=self.pk).update(**timestamps)
+        for field, value in timestamps.items():
+            setattr(self, field, value)
 
     def _prepare_notificaiton(self, notify_type):
         if notify_type == File.DOCUMENT_REMINDER:
@@ -337,6 +432,13 @@ class FileLog(models.Model):
     def __str__(self):
         return ' '.join(('log:', str(self.file), self.type))
 
+    def save(self, *args, **kwargs):
+        created = self.pk is None
+        with transaction.atomic():
+            super(FileLog, self).save(*args, **kwargs)
+            if created:
+                FileLogCounter.record([self])
+
     def notify_file_owner(self):
         context = {
             'document_log': self,
@@ -344,7 +446,260 @@ class FileLog(models.Model):
         subject = '[ACWL] Document downloaded'
         message = render_to_string('email/notifications/document_downloaded.txt', context=context)
         html_message = render_to_string('email/notifications/document_downloaded.html', context=context)
-        self.file.owner.email_user(subject, message, html_message=html_message)
+        owner = self.file.owner
+        MailDispatcher().send([(owner, build_message(owner, subject, message, html_message))])
+
+
+class FileVisibility(models.Model):
+    """One row per user and file the user may view, maintained from guardian permissions."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='file_visibility')
+    file = models.ForeignKey(File, related_name='visibility')
+
+    class Meta:
+        unique_together = ('user', 'file')
+
+
+class FileLogCounter(models.Model):
+    """Number of logs and time of the latest one per file, user and log type."""
+    file = models.ForeignKey(File, related_name='log_counters')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+    type = models.CharField(max_length=255, choices=FileLog.TYPES_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+    last_seen = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('file', 'type', 'user')
+
+    @classmethod
+    def record(cls, logs):
+        """Add ``logs`` to the counters: one read, one bulk insert and one update per increment."""
+        increments = {}
+        for log in logs:
+            if log.user_id is not None:
+                key = (log.file_id, log.user_id, log.type)
+                increments[key] = increments.get(key, 0) + 1
+        if not increments:
+            return
+        now = timezone.now()
+
+        existing = {}
+        for counter in cls.objects.filter(
+            file_id__in={file_id for file_id, user_id, type in increments},
+            user_id__in={user_id for file_id, user_id, type in increments},
+            type__in={type for file_id, user_id, type in increments},
+        ).only('id', 'file', 'user', 'type'):
+            key = (counter.file_id, counter.user_id, counter.type)
+            if key in increments:
+                existing[key] = counter.pk
+
+        missing = [cls(file_id=file_id, user_id=user_id, type=type, count=count, last_seen=now)
+                   for (file_id, user_id, type), count in increments.items()
+                   if (file_id, user_id, type) not in existing]
+        if missing:
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create(missing)
+            except IntegrityError:
+                # Created concurrently; count these logs against the rows that won the race.
+                cls.record(log for log in logs
+                           if (log.file_id, log.user_id, log.type) not in existing)
+                increments = {key: count for key, count in increments.items() if key in existing}
+
+        by_increment = {}
+        for key, pk in existing.items():
+            by_increment.setdefault(increments[key], []).append(pk)
+        for count, pks in by_increment.items():
+            cls.objects.filter(pk__in=pks).update(count=F('count') + count, last_seen=now)
+
+
+class FileLogWriter(object):
+    """Buffer download and notify logs and write them with ``bulk_create``.
+
+    Inside ``FileLogWriter.buffered()`` those events are collected per thread and flushed
+    when the block exits, or when the surrounding transaction commits. A block that raises
+    still writes its notify logs, since their mails are already out; its other events are
+    dropped, as are the events of a flush that fails. ``post_save`` is sent for every log
+    written. With ``FILE_LOG_BUFFERED = False`` every event is written immediately, which
+    keeps tests synchronous.
+    """
+    BUFFERED_TYPES = (FileLog.DOWNLOAD, FileLog.NOTIFY)
+
+    _local = threading.local()
+    _lock = threading.Lock()
+    counters = {'buffered': 0, 'flushed': 0, 'dropped': 0}
+
+    def __init__(self, max_size=None):
+        self.events = []
+        self.max_size = max_size or getattr(settings, 'FILE_LOG_BUFFER_SIZE', 500)
+
+    @classmethod
+    def current(cls):
+        stack = getattr(cls._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    @classmethod
+    def write(cls, log):
+        writer = cls.current()
+        if writer is None:
+            log.save()
+            cls._count('flushed', 1)
+        else:
+            writer.add(log)
+
+    @classmethod
+    @contextmanager
+    def buffered(cls, max_size=None):
+        if not getattr(settings, 'FILE_LOG_BUFFERED', True):
+            yield None
+            return
+        writer = cls(max_size)
+        stack = getattr(cls._local, 'stack', None)
+        if stack is None:
+            stack = cls._local.stack = []
+        stack.append(writer)
+        try:
+            yield writer
+        except Exception:
+            writer.drop(keep=(FileLog.NOTIFY,))
+            writer.close()
+            raise
+        finally:
+            stack.pop()
+        writer.close()
+
+    @classmethod
+    def _count(cls, counter, value):
+        with cls._lock:
+            cls.counters[counter] += value
+
+    def add(self, log):
+        self.events.append(log)
+        self._count('buffered', 1)
+        if len(self.events) >= self.max_size:
+            self.flush()
+
+    def close(self):
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(self.flush)
+        else:
+            self.flush()
+
+    def flush(self):
+        events, self.events = self.events, []
+        if not events:
+            return
+        try:
+            with transaction.atomic():
+                FileLog.objects.bulk_create(events)
+                FileLogCounter.record(events)
+        except DatabaseError:
+            logger.exception('Dropping %d file logs', len(events))
+            self._count('dropped', len(events))
+            return
+        self._count('flushed', len(events))
+        # bulk_create sends no signals. The logs have no pk on backends that cannot return it.
+        for log in events:
+            post_save.send(sender=FileLog, instance=log, created=True, update_fields=None, raw=False,
+                           using=log._state.db)
+
+    def drop(self, keep=()):
+        dropped = [log for log in self.events if log.type not in keep]
+        self._count('dropped', len(dropped))
+        self.events = [log for log in self.events if log.type in keep]
+
+
+@python_2_unicode_compatible
+class NotificationJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    )
+
+    METHOD_CHOICES = (
+        ('notify_contacts', _('Contacts')),
+        ('notify_receiver', _('Receivers')),
+        ('notify_users', _('Users')),
+        ('notify_members', _('Members')),
+        ('notify_owner', _('Owner')),
+    )
+
+    file = models.ForeignKey(File, related_name='notification_jobs')
+    method = models.CharField(max_length=32, choices=METHOD_CHOICES)
+    notify_type = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    # Set only while pending; the unique index keeps one pending job per file, method and type.
+    pending_key = models.CharField(max_length=320, null=True, unique=True, editable=False)
+
+    class Meta:
+        verbose_name = _('Notification Job')
+        verbose_name_plural = _('Notification Jobs')
+        index_together = (('status', 'created_at'),)
+
+    def __str__(self):
+        return ' '.join(('job:', str(self.file), self.method, self.notify_type))
+
+    @classmethod
+    def enqueue(cls, file, method, notify_type=''):
+        """Queue a fan-out, reusing a pending job for the same file, method and type."""
+        key = '{}:{}:{}'.format(file.pk, method, notify_type)
+        while True:
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(file_id=file.pk, method=method, notify_type=notify_type,
+                                              pending_key=key)
+            except IntegrityError:
+                # Claimed in between: the next attempt queues a new job.
+                job = cls.objects.filter(pending_key=key).first()
+                if job is not None:
+                    return job
+
+    @classmethod
+    def latency_percentile(cls, percentile=95, since=None):
+        """Enqueue-to-send latency in seconds at ``percentile`` over finished jobs."""
+        jobs = cls.objects.filter(status=cls.DONE)
+        if since:
+            jobs = jobs.filter(sent_at__gte=since)
+        latencies = sorted((sent_at - created_at).total_seconds()
+                           for created_at, sent_at in jobs.values_list('created_at', 'sent_at'))
+        if not latencies:
+            return None
+        index = int(round(percentile / 100.0 * (len(latencies) - 1)))
+        return latencies[index]
+
+    def claim(self):
+        now = timezone.now()
+        claimed = NotificationJob.objects.filter(pk=self.pk, status=self.PENDING).update(
+            status=self.RUNNING, started_at=now, pending_key=None,
+        )
+        if claimed:
+            self.status, self.started_at, self.pending_key = self.RUNNING, now, None
+        return bool(claimed)
+
+    def run(self):
+        notify = getattr(self.file, self.method)
+        try:
+            if self.notify_type:
+                notify(self.notify_type)
+            else:
+                notify()
+        except Exception as e:
+            self.status, self.error = self.FAILED, repr(e)
+            raise
+        else:
+            self.status, self.sent_at = self.DONE, timezone.now()
+        finally:
+            self.save(update_fields=['status', 'sent_at', 'error'])
 
 
 class Promotion(File):
@@ -426,3 +781,50 @@ class Document(File):
     def set_owner_perms(self, model='document'):
         super(Document, self).set_owner_perms(model=model)
 
+
+
+@receiver([post_save, post_delete], sender=UserObjectPermission)
+@receiver([post_save, post_delete], sender=GroupObjectPermission)
+def update_file_visibility(sender, instance, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(File).id:
+        rebuild_visibility(file_ids=[int(instance.object_pk)])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def update_user_visibility(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # post_clear of group.user_set carries no pk_set, so remember the members being removed.
+        instance._cleared_user_ids = list(instance.user_set.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        rebuild_visibility(user_ids=[instance.pk])
+    elif action == 'post_clear':
+        user_ids = getattr(instance, '_cleared_user_ids', [])
+        if user_ids:
+            rebuild_visibility(user_ids=user_ids)
+    elif pk_set:
+        rebuild_visibility(user_ids=list(pk_set))
+
+
+@receiver(post_save, sender=File)
+@receiver(post_save, sender=Promotion)
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=PriceList)
+@receiver(post_save, sender=Document)
+def update_search_index(sender, instance, **kwargs):
+    get_search_backend().update(instance)
+
+
+@receiver(post_delete, sender=File)
+@receiver(post_delete, sender=Promotion)
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=PriceList)
+@receiver(post_delete, sender=Document)
+def remove_from_search_index(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=SecureToken)
+def evict_secure_token(sender, instance, **kwargs):
+    cache.delete(token_cache_key(instance.token), version=token_generation())
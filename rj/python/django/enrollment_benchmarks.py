@@ -0,0 +1,38 @@
+import itertools
+from datetime import date, timedelta
+
+from backend.apps.document.benchmarks import measure
+from cdo.edu.division.models import Division
+from cdo.edu.division.occupancy import count_series
+from cdo.edu.management.imports import import_states
+from cdo.edu.management.models import Student, StudentState
+
+# Most queries each enrollment path may run, whatever the number of divisions and states.
+QUERY_BUDGETS = {
+    'count_series': 1,
+    'import_states': 6,
+}
+
+
+def generate_states(students, divisions, per_student, start_date=date(2015, 9, 1), days=30):
+    """Unsaved back to back states of ``days`` days for every student, cycling over ``divisions``."""
+    divisions = itertools.cycle(divisions)
+    return [
+        StudentState(parent=student, division=next(divisions),
+                     start_date=start_date + timedelta(days=days * i),
+                     end_date=start_date + timedelta(days=days * (i + 1)))
+        for student in students
+        for i in range(per_student)
+    ]
+
+
+def bench_enrollment(per_student=10, days=365):
+    """Wall time and query count of the bulk state import and the division count series."""
+    students = list(Student.objects.all())
+    divisions = list(Division.objects.all())
+    states = generate_states(students, divisions, per_student)
+    start_date = states[0].start_date
+    return {
+        'import_states': measure(import_states, states),
+        'count_series': measure(count_series, divisions, start_date, start_date + timedelta(days=days)),
+    }
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils.encoding import force_bytes, force_str
+
+
+class Echo(object):
+    def write(self, value):
+        return value
+
+
+def csv_chunks(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow([force_str(value) for value in header])
+    for row in rows:
+        yield writer.writerow([force_str('' if value is None else value) for value in row])
+
+
+def json_chunks(header, rows):
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',' if i else '') + json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder)
+    yield ']'
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(force_bytes(chunk))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_response(queryset, fields, filename, output='csv', compress=False, header=None):
+    """Stream ``fields`` of every row of ``queryset`` as CSV or JSON, optionally gzipped.
+
+    Rows are read with ``iterator()`` (a server-side cursor where the database supports it)
+    and written as they arrive, so memory use does not grow with the export.
+    """
+    header = header or fields
+    rows = queryset.values_list(*fields).iterator()
+    if output == 'json':
+        chunks, content_type = json_chunks(header, rows), 'application/json'
+    else:
+        chunks, content_type, output = csv_chunks(header, rows), 'text/csv', 'csv'
+    filename = '{}.{}'.format(filename, output)
+    if compress:
+        chunks, content_type, filename = gzip_chunks(chunks), 'application/gzip', filename + '.gz'
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
@@ -0,0 +1,62 @@
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from cdo.edu.division.occupancy import refresh_snapshots
+from cdo.edu.management.models import Student, StudentState
+
+
+def _overlaps(start_date, end_date):
+    """Whether a state starting at ``start_date`` begins before ``end_date`` (None is open)."""
+    return end_date is None or start_date < end_date
+
+
+def validate_states(states):
+    """Validate unsaved ``states`` with ``StudentState.clean``, then against each other.
+
+    Each student is loaded once with their saved states prefetched and set as the parent
+    of its rows, so ``clean`` checks every row without loading them again. Overlaps between
+    the rows themselves, which ``clean`` cannot see before they are saved, are found with a
+    sorted scan per student. Returns ``{row index: [messages]}`` for the rejected rows.
+    """
+    errors = defaultdict(list)
+    accessor = StudentState._meta.get_field('parent').remote_field.get_accessor_name()
+    students = Student.objects.prefetch_related(accessor).in_bulk(set(state.parent_id for state in states))
+
+    rows = defaultdict(list)
+    for index, state in enumerate(states):
+        student = students.get(state.parent_id)
+        if student is None:
+            errors[index].append('Unknown student.')
+            continue
+        state.parent = student
+        try:
+            state.clean_fields(exclude=['parent', 'division'])
+            state.clean()
+        except ValidationError as error:
+            errors[index].extend(error.messages)
+            continue
+        rows[state.parent_id].append((state.start_date, index, state.end_date))
+
+    for student_rows in rows.values():
+        latest_end = None
+        for position, (start_date, index, end_date) in enumerate(sorted(student_rows)):
+            if position and _overlaps(start_date, latest_end):
+                errors[index].append('State overlaps another row of the import.')
+                continue
+            if not position or latest_end is not None and (end_date is None or end_date > latest_end):
+                latest_end = end_date
+    return dict(errors)
+
+
+def import_states(states, batch_size=500):
+    """Insert the valid ``states`` with ``bulk_create``; returns ``(created, errors)``."""
+    states = list(states)
+    errors = validate_states(states)
+    valid = [state for index, state in enumerate(states) if index not in errors]
+    with transaction.atomic():
+        created = StudentState.objects.bulk_create(valid, batch_size=batch_size)
+        # bulk_create sends no signals, so the daily snapshots are refreshed here.
+        refresh_snapshots(created)
+    return created, errors
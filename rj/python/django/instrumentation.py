@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import logging
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+METRICS = (
+    ('calls', 'counter', 'Instrumented calls'),
+    ('queries', 'counter', 'SQL queries run'),
+    ('db_seconds', 'counter', 'Seconds spent in SQL queries'),
+    ('seconds', 'counter', 'Seconds spent in total'),
+    ('recipients', 'counter', 'Notification recipients processed'),
+    ('slow', 'counter', 'Calls slower than the slow-path threshold'),
+)
+
+_lock = threading.Lock()
+_local = threading.local()
+registry = {}
+
+
+class instrument(object):
+    """Measure queries, DB time, total time and recipients of a block, view or method.
+
+    Use it as ``with instrument('name') as measurement:`` or as ``@instrument('name')``. A
+    block may rename itself, or drop its measurement by setting ``name`` to None. Nothing
+    is measured unless ``DOCUMENT_INSTRUMENTATION`` is set.
+    Results are added to ``registry`` (see ``render_metrics``) and outermost blocks are
+    logged as JSON on the ``backend.apps.document.instrumentation`` logger; blocks slower
+    than ``DOCUMENT_SLOW_THRESHOLD`` seconds are logged as warnings with their SQL.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.recipients = 0
+
+    def __call__(self, func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with instrument(self.name):
+                return func(*args, **kwargs)
+        return inner
+
+    def __enter__(self):
+        self.enabled = getattr(settings, 'DOCUMENT_INSTRUMENTATION', False)
+        if not self.enabled:
+            return self
+        self.nested = bool(_stack())
+        self.debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        # The log is a bounded deque, so remember its last entry rather than its length.
+        self.marker = connection.queries_log[-1] if connection.queries_log else None
+        self.started = time.time()
+        _stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.enabled:
+            return
+        seconds = time.time() - self.started
+        _stack().pop()
+        connection.force_debug_cursor = self.debug_cursor
+        queries = self.queries()
+        if not connection.queries_logged:
+            # Nobody else reads the log: keep it from filling up in long running workers.
+            connection.queries_log.clear()
+        if self.name is None:
+            return
+        db_seconds = sum(float(query['time']) for query in queries)
+        slow = seconds >= getattr(settings, 'DOCUMENT_SLOW_THRESHOLD', 1.0)
+
+        with _lock:
+            values = registry.setdefault(self.name, dict.fromkeys([metric for metric, kind, help in METRICS], 0))
+            values['calls'] += 1
+            values['queries'] += len(queries)
+            values['db_seconds'] += db_seconds
+            values['seconds'] += seconds
+            values['recipients'] += self.recipients
+            values['slow'] += slow
+
+        measurement = {
+            'name': self.name,
+            'queries': len(queries),
+            'db_seconds': round(db_seconds, 6),
+            'seconds': round(seconds, 6),
+            'recipients': self.recipients,
+        }
+        if slow:
+            measurement['sql'] = [query['sql'] for query in queries]
+            logger.warning(json.dumps(measurement))
+        elif not self.nested:
+            logger.info(json.dumps(measurement))
+
+    def queries(self):
+        """Log entries of the queries run since the block started."""
+        queries = []
+        for query in reversed(connection.queries_log):
+            if query is self.marker:
+                break
+            queries.append(query)
+        queries.reverse()
+        return queries
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def add_recipients(count):
+    """Count ``count`` recipients against every block currently being measured."""
+    for measurement in _stack():
+        measurement.recipients += count
+
+
+def render_metrics():
+    """The registry in the Prometheus text exposition format."""
+    with _lock:
+        snapshot = {name: dict(values) for name, values in registry.items()}
+    lines = []
+    for metric, kind, help in METRICS:
+        full_name = 'document_{}_total'.format(metric)
+        lines.append('# HELP {} {}'.format(full_name, help))
+        lines.append('# TYPE {} {}'.format(full_name, kind))
+        for name in sorted(snapshot):
+            lines.append('{}{{name="{}"}} {}'.format(full_name, name, snapshot[name][metric]))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4')
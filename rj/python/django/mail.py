@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import smtplib
+import socket
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.template import Context
+from django.template.loader import get_template
+from django.utils.inspect import func_accepts_kwargs, func_supports_parameter
+from django.utils.lru_cache import lru_cache
+
+logger = logging.getLogger(__name__)
+
+
+class RecipientMessage(object):
+    """A rendered notification, built by the recipient's own ``email_user``.
+
+    Users and contacts keep control over sender, address and opt-outs. When their
+    ``email_user`` forwards keyword arguments to ``send_mail`` (as Django's does) the message
+    it builds is collected and sent by the dispatcher with the rest of its batch; otherwise
+    ``email_user`` sends it on its own.
+    """
+
+    def __init__(self, recipient, subject, message, html_message=None):
+        self.recipient = recipient
+        self.subject = subject
+        self.message = message
+        self.html_message = html_message
+
+    def accepts_connection(self):
+        email_user = self.recipient.email_user
+        return func_accepts_kwargs(email_user) or func_supports_parameter(email_user, 'connection')
+
+    def email_messages(self):
+        """The ``EmailMessage`` objects ``email_user`` builds, without sending them."""
+        collector = MessageCollector()
+        self.recipient.email_user(self.subject, self.message, html_message=self.html_message,
+                                  connection=collector)
+        return collector.messages
+
+    def send(self):
+        self.recipient.email_user(self.subject, self.message, html_message=self.html_message)
+
+
+class MessageCollector(object):
+    """Stands in for a mail connection and keeps the messages handed to it."""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_messages(self, messages):
+        self.messages.extend(messages)
+        return len(messages)
+
+
+def build_message(recipient, subject, message, html_message=None):
+    return RecipientMessage(recipient, subject, message, html_message)
+
+
+@lru_cache(maxsize=32)
+def get_templates(text_template, html_template):
+    return get_template(text_template), get_template(html_template)
+
+
+class NotificationRenderer(object):
+    """Render one notification for many recipients.
+
+    The template pair is compiled once per process and the fan-out wide context is built
+    once; each message only pushes its recipient-specific fields on top of it.
+    """
+
+    def __init__(self, subject, text_template, html_template, **shared):
+        self.subject = subject
+        self.text_template, self.html_template = get_templates(text_template, html_template)
+        self.context = Context(shared, autoescape=self.text_template.template.engine.autoescape)
+
+    def render(self, recipient, **context):
+        with self.context.push(recipient=recipient, **context):
+            message = self.text_template.template.render(self.context)
+            html_message = self.html_template.template.render(self.context)
+        return build_message(recipient, self.subject, message, html_message)
+
+
+class MailDispatcher(object):
+    """Send a notification fan-out over one mail backend connection.
+
+    The messages of each batch of ``batch_size`` go out with a single ``send_messages`` call.
+    When it fails the connection is reopened and the batch is retried up to ``retries``
+    times before it is given up; messages sent before the failure may go out twice.
+    Recipients whose ``email_user`` cannot take a connection are sent one by one.
+    ``send`` returns the recipients whose message was delivered and raises when the
+    connection cannot be opened.
+    """
+    errors = (smtplib.SMTPException, socket.error)
+
+    def __init__(self, batch_size=None, retries=None, connection=None):
+        self.batch_size = batch_size or getattr(settings, 'NOTIFICATION_MAIL_BATCH_SIZE', 100)
+        self.retries = retries if retries is not None else getattr(settings, 'NOTIFICATION_MAIL_RETRIES', 2)
+        self.connection = connection or get_connection()
+
+    def send(self, messages):
+        """Send ``(recipient, message)`` pairs and return the delivered recipients."""
+        messages = list(messages)
+        delivered = []
+        if not messages:
+            return delivered
+
+        batched = [(recipient, message) for recipient, message in messages if message.accepts_connection()]
+        for recipient, message in messages:
+            if not message.accepts_connection():
+                try:
+                    message.send()
+                except self.errors:
+                    logger.exception('Could not send a notification email to %s', recipient)
+                else:
+                    delivered.append(recipient)
+        if not batched:
+            return delivered
+
+        self.connection.open()
+        try:
+            for start in range(0, len(batched), self.batch_size):
+                delivered.extend(self._send_batch(batched[start:start + self.batch_size]))
+        finally:
+            self.connection.close()
+        return delivered
+
+    def _send_batch(self, batch):
+        emails = [email for recipient, message in batch for email in message.email_messages()]
+        for attempt in range(self.retries + 1):
+            try:
+                if attempt:
+                    self._reconnect()
+                self.connection.send_messages(emails)
+            except self.errors:
+                if attempt == self.retries:
+                    logger.exception('Giving up on %d notification emails', len(emails))
+            else:
+                return [recipient for recipient, message in batch]
+        return []
+
+    def _reconnect(self):
+        try:
+            self.connection.close()
+        except self.errors:
+            pass
+        self.connection.open()
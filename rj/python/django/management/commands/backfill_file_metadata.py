@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+from multiprocessing.pool import ThreadPool
+
+from backend.apps.document.models import File
+from django import db
+from django.core.management.base import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+
+def backfill(file_id):
+    try:
+        instance = File.all_objects.get(pk=file_id)
+        instance.extract_file_metadata()
+        File.all_objects.filter(pk=file_id).update(
+            mime_type=instance.mime_type,
+            file_size=instance.file_size,
+            checksum=instance.checksum,
+        )
+        return True
+    except Exception:
+        logger.exception('Could not read metadata of file %s', file_id)
+        return False
+    finally:
+        db.connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Store MIME type, size and checksum of files uploaded before they were recorded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--all', action='store_true', help='Recompute files that already have metadata')
+
+    def handle(self, *args, **options):
+        files = File.all_objects.exclude(file='')
+        if not options['all']:
+            files = files.filter(checksum='')
+        file_ids = list(files.values_list('id', flat=True))
+
+        pool = ThreadPool(options['workers'])
+        try:
+            results = pool.map(backfill, file_ids, chunksize=16)
+        finally:
+            pool.close()
+            pool.join()
+        self.stdout.write('Updated {} of {} files'.format(results.count(True), len(file_ids)))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import time
+from collections import Counter
+
+from backend.apps.document.models import File
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Delete stored file blobs and names no file row references, soft-deleted rows included'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Keep blobs and names younger than this many seconds (uploads in flight)')
+        parser.add_argument('--adopt', action='store_true',
+                            help='First move referenced files stored before deduplication into blobs')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        storage = File._meta.get_field('file').storage
+        files = File.all_objects.exclude(file='')
+        names = set(files.values_list('file', flat=True))
+        digests = set(files.exclude(checksum='').values_list('checksum', flat=True))
+        cutoff = time.time() - options['min_age']
+        dry_run = options['dry_run']
+
+        if options['adopt'] and not dry_run:
+            adopted = sum(storage.adopt(name) for name in names if storage.exists(name))
+            self.stdout.write('Adopted {} files'.format(adopted))
+
+        blobs = {}
+        for digest, path in storage.blobs():
+            stat = os.stat(path)
+            blobs[stat.st_dev, stat.st_ino] = digest, path, stat.st_ctime
+
+        unlinked = Counter()
+        root = storage.path('')
+        for directory, dirnames, filenames in os.walk(root):
+            if directory == root and storage.blob_dir in dirnames:
+                dirnames.remove(storage.blob_dir)
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                stat = os.stat(path)
+                # Linking a name changes the ctime of the blob inode, so fresh names are kept.
+                if (stat.st_dev, stat.st_ino) in blobs and name not in names and stat.st_ctime < cutoff:
+                    unlinked[stat.st_dev, stat.st_ino] += 1
+                    if not dry_run:
+                        os.remove(path)
+
+        deleted = freed = 0
+        for key, (digest, path, ctime) in blobs.items():
+            stat = os.stat(path)
+            links = stat.st_nlink - (unlinked[key] if dry_run else 0)
+            if digest in digests or links > 1 or ctime >= cutoff:
+                continue
+            deleted += 1
+            freed += stat.st_size
+            if not dry_run:
+                os.remove(path)
+
+        self.stdout.write('Removed {} names and {} blobs, {} bytes{}'.format(
+            sum(unlinked.values()), deleted, freed, ' (dry run)' if dry_run else ''))
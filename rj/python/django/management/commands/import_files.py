@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+
+from backend.apps.auth.models import User
+from backend.apps.document.models import File
+from backend.apps.document.permissions import bulk_assign_perms
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = 'Import files listed in a CSV file (name, file, owner[, short_description, description])'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file')
+        parser.add_argument('--category', choices=[category for category, label in File.CATEGORY_CHOICES],
+                            default=File.PRICE_LIST)
+        parser.add_argument('--viewer', action='append', default=[], help='Username granted view access')
+        parser.add_argument('--group', action='append', default=[], help='Group name granted view access')
+        parser.add_argument('--notify', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        viewers = list(User.objects.filter(username__in=options['viewer']))
+        groups = list(Group.objects.filter(name__in=options['group']))
+        if len(viewers) != len(options['viewer']) or len(groups) != len(options['group']):
+            raise CommandError('Unknown viewer or group')
+
+        with open(options['csv_file']) as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        owners = {user.username: user for user in User.objects.filter(username__in={row['owner'] for row in rows})}
+        unknown = {row['owner'] for row in rows} - set(owners)
+        if unknown:
+            raise CommandError('Unknown owners: {}'.format(', '.join(sorted(unknown))))
+
+        imported = 0
+        for start in range(0, len(rows), options['batch_size']):
+            with transaction.atomic():
+                files = []
+                for row in rows[start:start + options['batch_size']]:
+                    instance = File.objects.create(
+                        name=row['name'],
+                        file=row['file'],
+                        owner=owners[row['owner']],
+                        category=options['category'],
+                        short_description=row.get('short_description', ''),
+                        description=row.get('description', ''),
+                        notify=options['notify'],
+                    )
+                    instance.log_create(instance.owner)
+                    files.append(instance)
+                bulk_assign_perms(files, model=options['category'], users=viewers, groups=groups)
+            imported += len(files)
+            self.stdout.write('Imported {} of {} files'.format(imported, len(rows)))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import time
+from multiprocessing.pool import Pool, ThreadPool
+
+from backend.apps.document.models import NotificationJob
+from django import db
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def run_job(job_id):
+    try:
+        job = NotificationJob.objects.select_related('file').get(pk=job_id)
+        if not job.claim():
+            return False
+        try:
+            job.run()
+        except Exception:
+            logger.exception('Notification job %s failed', job_id)
+            return False
+        return True
+    finally:
+        db.connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Drain the notification job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--processes', action='store_true',
+                            help='Use a process pool instead of a thread pool')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        started = timezone.now()
+        if options['processes']:
+            db.connections.close_all()
+            pool = Pool(options['workers'])
+        else:
+            pool = ThreadPool(options['workers'])
+
+        sent = failed = 0
+        try:
+            while True:
+                job_ids = list(NotificationJob.objects.filter(status=NotificationJob.PENDING)
+                               .order_by('created_at').values_list('id', flat=True)[:options['batch_size']])
+                if not job_ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+                results = pool.map(run_job, job_ids)
+                sent += results.count(True)
+                failed += results.count(False)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pool.close()
+            pool.join()
+
+        latency = NotificationJob.latency_percentile(95, since=started)
+        self.stdout.write('Sent {} jobs, {} failed or skipped, p95 enqueue-to-send latency: {}'.format(
+            sent, failed, '{:.2f}s'.format(latency) if latency is not None else 'n/a'))
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from backend.apps.document.models import FileLog, FileLogCounter
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per file, user and type log counters from the file logs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=int, action='append', dest='files',
+                            help='Only rebuild counters of this file id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        logs = FileLog.objects.filter(user__isnull=False)
+        counters = FileLogCounter.objects.all()
+        if options['files']:
+            logs = logs.filter(file_id__in=options['files'])
+            counters = counters.filter(file_id__in=options['files'])
+
+        rows = (logs.order_by().values('file', 'user', 'type')
+                .annotate(count=Count('id'), last_seen=Max('datetime')).iterator())
+        created = 0
+        with transaction.atomic():
+            counters.delete()
+            batch = []
+            for row in rows:
+                batch.append(FileLogCounter(file_id=row['file'], user_id=row['user'], type=row['type'],
+                                            count=row['count'], last_seen=row['last_seen']))
+                if len(batch) >= options['batch_size']:
+                    FileLogCounter.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            FileLogCounter.objects.bulk_create(batch)
+            created += len(batch)
+        self.stdout.write('Rebuilt {} counters'.format(created))
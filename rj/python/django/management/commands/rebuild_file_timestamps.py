@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from backend.apps.document.models import File, FileLog
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+
+class Command(BaseCommand):
+    help = 'Recompute File.created_at / modified_at from the file logs'
+
+    def handle(self, *args, **options):
+        logs = (FileLog.objects.filter(type__in=(FileLog.CREATE, FileLog.MODIFY))
+                .values('file', 'type').annotate(datetime=Max('datetime')))
+        timestamps = {}
+        for row in logs:
+            timestamps.setdefault(row['file'], {})[row['type']] = row['datetime']
+
+        with transaction.atomic():
+            for file_id, latest in timestamps.items():
+                created_at = latest.get(FileLog.CREATE)
+                File.all_objects.filter(pk=file_id).update(
+                    created_at=created_at,
+                    modified_at=latest.get(FileLog.MODIFY, created_at),
+                )
+        self.stdout.write('Updated {} files'.format(len(timestamps)))
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from backend.apps.document.permissions import rebuild_visibility
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per user file visibility index from guardian permissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=int, action='append', dest='files',
+                            help='Only rebuild rows of this file id (repeatable)')
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='Only rebuild rows of this user id (repeatable)')
+
+    def handle(self, *args, **options):
+        count = rebuild_visibility(file_ids=options['files'], user_ids=options['users'])
+        self.stdout.write('Indexed {} visible files'.format(count))
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from backend.apps.document.models import File
+from backend.apps.document.search import get_backend
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of files'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        indexed = 0
+        with transaction.atomic():
+            for file in File.all_objects.only('id', 'is_delete', *backend.fields).iterator():
+                backend.update(file)
+                indexed += not file.is_delete
+        self.stdout.write('Indexed {} files'.format(indexed))
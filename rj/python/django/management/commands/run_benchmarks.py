@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import os
+
+from backend.apps.document.benchmarks import QUERY_BUDGETS, bench_hot_paths, check_budgets
+from cdo.edu.management import enrollment_benchmarks
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Time the document and enrollment hot paths over generated data and check their query budgets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--files', type=int, default=20)
+        parser.add_argument('--logs', type=int, default=1000)
+        parser.add_argument('--states-per-student', type=int, default=10)
+        parser.add_argument('--days', type=int, default=365, help='Length of the division count series')
+        parser.add_argument('--output', default='benchmarks.json', help='Where to write the JSON results')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        results = bench_hot_paths(users=options['users'], files=options['files'], logs=options['logs'])
+        results.update(enrollment_benchmarks.bench_enrollment(per_student=options['states_per_student'],
+                                                              days=options['days']))
+        previous = {}
+        if options['compare'] and os.path.exists(options['compare']):
+            with open(options['compare']) as compare:
+                previous = json.load(compare)['results']
+
+        for name, result in sorted(results.items()):
+            line = '{}: {:.3f}s, {} queries'.format(name, result['seconds'], result['queries'])
+            if name in previous:
+                line += ' (was {:.3f}s, {} queries)'.format(previous[name]['seconds'], previous[name]['queries'])
+            self.stdout.write(line)
+
+        with open(options['output'], 'w') as output:
+            json.dump({
+                'users': options['users'],
+                'files': options['files'],
+                'logs': options['logs'],
+                'states_per_student': options['states_per_student'],
+                'days': options['days'],
+                'results': results,
+            }, output, indent=2, sort_keys=True)
+
+        budgets = dict(QUERY_BUDGETS, **enrollment_benchmarks.QUERY_BUDGETS)
+        overruns = check_budgets(results, budgets)
+        if overruns:
+            raise CommandError('Query budgets exceeded: ' + '; '.join(overruns))
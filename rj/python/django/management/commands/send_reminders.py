@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import logging
+import os
+import time
+from multiprocessing import Pool
+
+from backend.apps.document.models import File
+from django import db
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+logger = logging.getLogger(__name__)
+
+
+def candidates():
+    return File.objects.filter(notify=True, category__in=(File.DOCUMENT, File.POST))
+
+
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path) as checkpoint:
+        return json.load(checkpoint)
+
+
+def write_json(path, data):
+    with open(path + '.tmp', 'w') as checkpoint:
+        json.dump(data, checkpoint)
+    os.rename(path + '.tmp', path)
+
+
+def remind(file, send_now=False):
+    """Queue the reminders of ``file`` for ``notify_worker``, or send them right away."""
+    if file.category == File.DOCUMENT:
+        notifications = [('notify_receiver', File.DOCUMENT_REMINDER), ('notify_owner', '')]
+    else:
+        notifications = [('notify_members', File.POST_REMINDER)]
+    for method, notify_type in notifications:
+        if not send_now:
+            file.enqueue_notification(method, notify_type)
+        elif notify_type:
+            getattr(file, method)(notify_type)
+        else:
+            getattr(file, method)()
+
+
+def run_shard(args):
+    """Send reminders for files with ``start <= pk < stop``, resuming after the checkpointed pk."""
+    shard, start, stop, checkpoint, chunk_size, send_now = args
+    progress_path = '{}.{}'.format(checkpoint, shard)
+    progress = read_json(progress_path, {'last_pk': None, 'files': 0, 'seconds': 0})
+    resumed_files = progress['files']
+    timer = (progress['seconds'], time.time())
+
+    file_ids = candidates().filter(pk__gte=start, pk__lt=stop)
+    if progress['last_pk'] is not None:
+        file_ids = file_ids.filter(pk__gt=progress['last_pk'])
+    file_ids = file_ids.order_by('pk').values_list('pk', flat=True).iterator()
+
+    try:
+        chunk = []
+        for file_id in file_ids:
+            chunk.append(file_id)
+            if len(chunk) == chunk_size:
+                process_chunk(chunk, progress, progress_path, timer, send_now)
+                chunk = []
+        process_chunk(chunk, progress, progress_path, timer, send_now)
+    finally:
+        db.connection.close()
+    return shard, progress['files'], progress['seconds'], progress['files'] - resumed_files
+
+
+def process_chunk(chunk, progress, progress_path, timer, send_now):
+    if not chunk:
+        return
+    # The long text columns are not needed to send a reminder.
+    files = File.objects.filter(pk__in=chunk).select_related('owner').defer('description', 'short_description')
+    for file in files.order_by('pk'):
+        try:
+            remind(file, send_now)
+        except Exception:
+            logger.exception('Reminder for file %s failed', file.pk)
+    progress['last_pk'] = chunk[-1]
+    progress['files'] += len(chunk)
+    previous_seconds, started = timer
+    progress['seconds'] = previous_seconds + time.time() - started
+    write_json(progress_path, progress)
+
+
+class Command(BaseCommand):
+    help = 'Send document and post reminders across a pool of shards, resuming an interrupted run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, default=4)
+        parser.add_argument('--chunk-size', type=int, default=200)
+        parser.add_argument('--checkpoint', default='reminders.checkpoint')
+        parser.add_argument('--restart', action='store_true', help='Ignore an unfinished run')
+        parser.add_argument('--send-now', action='store_true',
+                            help='Send the reminders instead of queueing them for notify_worker')
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        plan = None if options['restart'] else read_json(checkpoint)
+        if plan is None:
+            self.clear(checkpoint, options['shards'])
+            plan = self.plan(options['shards'])
+            write_json(checkpoint, plan)
+        else:
+            self.stdout.write('Resuming run of {} shards'.format(len(plan)))
+
+        started = time.time()
+        db.connections.close_all()
+        pool = Pool(len(plan) or 1)
+        try:
+            results = pool.map(run_shard, [(shard, start, stop, checkpoint, options['chunk_size'],
+                                            options['send_now'])
+                                           for shard, (start, stop) in enumerate(plan)])
+        finally:
+            pool.close()
+            pool.join()
+        elapsed = time.time() - started
+
+        total = processed = 0
+        for shard, files, seconds, run_files in results:
+            total += files
+            processed += run_files
+            self.stdout.write('Shard {}: {} files in {:.1f}s'.format(shard, files, seconds))
+        # Files done by an interrupted run are in the totals but not in this run's rate.
+        self.stdout.write('{} files, {} in this run in {:.1f}s ({:.1f} files/s)'.format(
+            total, processed, elapsed, processed / elapsed if elapsed else 0))
+        self.clear(checkpoint, len(plan))
+
+    def plan(self, shards):
+        """Split the candidate pk range into ``shards`` contiguous ``[start, stop)`` ranges."""
+        bounds = candidates().aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            return []
+        low, high = bounds['low'], bounds['high'] + 1
+        step = max((high - low + shards - 1) // shards, 1)
+        return [(start, min(start + step, high)) for start in range(low, high, step)]
+
+    def clear(self, checkpoint, shards):
+        for path in [checkpoint] + ['{}.{}'.format(checkpoint, shard) for shard in range(shards)]:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from backend.apps.document.instrumentation import instrument
+from backend.apps.document.models import FileLogWriter
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+
+class FileLogBufferMiddleware(object):
+    """Buffer the download and notify logs written while handling a request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with FileLogWriter.buffered():
+            return self.get_response(request)
+
+
+class InstrumentationMiddleware(object):
+    """Measure requests served by document views, one metric per view and HTTP method.
+
+    Only installed when ``DOCUMENT_INSTRUMENTATION`` is set.
+    """
+    app_module = 'backend.apps.document'
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'DOCUMENT_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            measurement = getattr(request, '_instrument', None)
+            if measurement is not None:
+                measurement.__exit__(None, None, None)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        name = self.metric_name(request)
+        if name is not None:
+            request._instrument = instrument(name).__enter__()
+
+    def metric_name(self, request):
+        match = request.resolver_match
+        if match is None or not match.func.__module__.startswith(self.app_module):
+            return None
+        return 'request.{}.{}'.format(match.url_name or match.func.__name__, request.method)
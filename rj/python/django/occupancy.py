@@ -0,0 +1,143 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Max, Min, Q
+
+from cdo.edu.division.models import DivisionDailyCount
+from cdo.edu.management.models import StudentState
+
+
+def _days(start_date, end_date):
+    return [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days)]
+
+
+def _division_ids(divisions):
+    return [getattr(division, 'pk', division) for division in divisions]
+
+
+def count_series(divisions, start_date, end_date, use_snapshots=False):
+    """Daily student counts of ``divisions`` for every day in ``[start_date, end_date)``.
+
+    Returns ``{division_id: [(day, count), ...]}``. A state counts on ``day`` when
+    ``start_date <= day < end_date``, an empty ``end_date`` meaning it is still open, which
+    is what ``Division.get_count(day)`` answers for a single day. The counts of a whole
+    batch come from a single query over the overlapping states, swept as +1 / -1 events.
+    With ``use_snapshots`` the days already kept in ``DivisionDailyCount`` are read from it.
+    """
+    division_ids = _division_ids(divisions)
+    days = _days(start_date, end_date)
+    series = {}
+    if use_snapshots:
+        snapshots = defaultdict(dict)
+        rows = DivisionDailyCount.objects.filter(
+            division_id__in=division_ids, day__gte=start_date, day__lt=end_date,
+        ).values_list('division_id', 'day', 'count')
+        for division_id, day, count in rows:
+            snapshots[division_id][day] = count
+        for division_id in division_ids:
+            if len(snapshots[division_id]) == len(days):
+                series[division_id] = [(day, snapshots[division_id][day]) for day in days]
+    missing = [division_id for division_id in division_ids if division_id not in series]
+    if missing:
+        series.update(_sweep(missing, start_date, end_date, days))
+    return series
+
+
+def _sweep(division_ids, start_date, end_date, days):
+    deltas = defaultdict(lambda: defaultdict(int))
+    states = StudentState.objects.filter(
+        division_id__in=division_ids, start_date__lt=end_date,
+    ).filter(
+        Q(end_date__isnull=True) | Q(end_date__gt=start_date)
+    ).values_list('division_id', 'start_date', 'end_date')
+    for division_id, state_start, state_end in states:
+        deltas[division_id][max(state_start, start_date)] += 1
+        if state_end is not None and state_end < end_date:
+            deltas[division_id][state_end] -= 1
+
+    series = {}
+    for division_id in division_ids:
+        count, events = 0, deltas[division_id]
+        series[division_id] = []
+        for day in days:
+            count += events.get(day, 0)
+            series[division_id].append((day, count))
+    return series
+
+
+def build_snapshots(divisions, start_date, end_date):
+    """(Re)build the snapshot rows of ``divisions`` for ``[start_date, end_date)``."""
+    series = count_series(divisions, start_date, end_date)
+    with transaction.atomic():
+        DivisionDailyCount.objects.filter(
+            division_id__in=list(series), day__gte=start_date, day__lt=end_date,
+        ).delete()
+        DivisionDailyCount.objects.bulk_create(
+            DivisionDailyCount(division_id=division_id, day=day, count=count)
+            for division_id, counts in series.items()
+            for day, count in counts
+        )
+
+
+def refresh_snapshots(states):
+    """Recompute the snapshot rows ``states`` may have changed, for writes that send no signals.
+
+    Only days already kept in ``DivisionDailyCount`` are rewritten.
+    """
+    states = list(states)
+    if not states:
+        return
+    division_ids = set(state.division_id for state in states)
+    start_date = min(state.start_date for state in states)
+    rows = DivisionDailyCount.objects.filter(division_id__in=division_ids, day__gte=start_date)
+    bounds = rows.aggregate(first=Min('day'), last=Max('day'))
+    if bounds['first'] is None:
+        return
+    end_date = bounds['last'] + timedelta(days=1)
+    if all(state.end_date is not None for state in states):
+        end_date = min(end_date, max(state.end_date for state in states))
+    rows = rows.filter(day__lt=end_date)
+    kept = set(rows.values_list('division_id', 'day'))
+    series = count_series(division_ids, bounds['first'], end_date)
+    with transaction.atomic():
+        rows.delete()
+        DivisionDailyCount.objects.bulk_create(
+            DivisionDailyCount(division_id=division_id, day=day, count=count)
+            for division_id, counts in series.items()
+            for day, count in counts
+            if (division_id, day) in kept
+        )
+
+
+def _shift(division_id, start_date, end_date, delta):
+    """Add ``delta`` to the snapshot rows a state over ``[start_date, end_date)`` covers."""
+    if division_id is None or start_date is None:
+        return
+    rows = DivisionDailyCount.objects.filter(division_id=division_id, day__gte=start_date)
+    if end_date is not None:
+        rows = rows.filter(day__lt=end_date)
+    rows.update(count=F('count') + delta)
+
+
+def remember_state_range(sender, instance, raw=False, **kwargs):
+    instance._snapshot_range = None
+    if instance.pk and not raw:
+        instance._snapshot_range = StudentState.objects.filter(pk=instance.pk).values_list(
+            'division_id', 'start_date', 'end_date').first()
+
+
+def update_snapshots_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_snapshot_range', None)
+    current = (instance.division_id, instance.start_date, instance.end_date)
+    if previous == current:
+        return
+    if previous is not None:
+        _shift(*previous, delta=-1)
+    _shift(*current, delta=1)
+
+
+def update_snapshots_on_delete(sender, instance, **kwargs):
+    _shift(instance.division_id, instance.start_date, instance.end_date, delta=-1)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import base64
+import hashlib
+import json
+import re
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db import models
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.utils import six
+from django.utils.encoding import force_bytes, force_text
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+EXPLAIN_ROWS_RE = re.compile(r'rows=(\d+)')
+
+
+def keyset_filter(ordering, values, nulls_largest=False):
+    """Q selecting the rows after ``values`` in ``ordering`` (a list of ``-field`` / ``field``).
+
+    Every field is compared in its own direction, so mixed orderings work; the last field
+    must be unique (the primary key) for the keyset to be stable. NULL values are placed
+    the way the database sorts them: after every value when ``nulls_largest`` (PostgreSQL,
+    Oracle), before them otherwise (SQLite, MySQL).
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        if value is None:
+            if nulls_largest == descending:
+                condition |= equal & Q(**{'{}__isnull'.format(name): False})
+            equal &= Q(**{'{}__isnull'.format(name): True})
+        else:
+            after = Q(**{'{}__{}'.format(name, 'lt' if descending else 'gt'): value})
+            if nulls_largest != descending:
+                after |= Q(**{'{}__isnull'.format(name): True})
+            condition |= equal & after
+            equal &= Q(**{name: value})
+    return condition
+
+
+class KeysetPagination(pagination.LimitOffsetPagination):
+    """Limit/offset pagination with an opt-in keyset mode.
+
+    A request carrying ``cursor`` (empty for the first page) is paginated on the active
+    ordering plus the primary key, so any page costs the same as the first one. The total is
+    only computed on request: ``count=exact``, ``count=cached`` (cached for
+    ``DOCUMENT_COUNT_CACHE_TIMEOUT`` seconds) or ``count=approximate`` (planner estimate on
+    PostgreSQL, cached count elsewhere).
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    default_ordering = ('-pk',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.keyset = False
+            return super(KeysetPagination, self).paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.request = request
+        self.limit = self.get_limit(request) or 100
+        self.count = self.get_total(queryset, request.query_params.get(self.count_query_param))
+        values, reverse = self.decode_cursor(request.query_params[self.cursor_query_param])
+
+        self.ordering = self.get_ordering(queryset)
+        ordering = [self.invert(field) for field in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            nulls_largest = connections[queryset.db].vendor in ('postgresql', 'oracle')
+            queryset = queryset.filter(keyset_filter(ordering, values, nulls_largest))
+
+        rows = list(queryset[:self.limit + 1])
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if reverse:
+            rows.reverse()
+        # Walking backwards there is always a next page and a previous one only if rows were left over.
+        has_next, has_previous = (True, has_more) if reverse else (has_more, values is not None)
+        self.next_values = self.row_values(rows[-1]) if rows and has_next else None
+        self.previous_values = self.row_values(rows[0]) if rows and has_previous else None
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super(KeysetPagination, self).get_paginated_response(data)
+        payload = OrderedDict()
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['next'] = self.cursor_link(self.next_values, reverse=False)
+        payload['previous'] = self.cursor_link(self.previous_values, reverse=True)
+        payload['results'] = data
+        return Response(payload)
+
+    def get_ordering(self, queryset):
+        ordering = [self.normalize(queryset.model, field) for field in
+                    queryset.query.order_by or queryset.model._meta.ordering or self.default_ordering]
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            ordering.append('-pk' if ordering[-1].startswith('-') else 'pk')
+        return ordering
+
+    def normalize(self, model, field):
+        """``field`` as a path the cursor can compare, a relation ordered by its key column.
+
+        ``order_by('owner')`` sorts by the related model's ``Meta.ordering``, which the cursor
+        does not follow, so it becomes ``owner_id``. Expressions, random ordering and
+        multi-valued relations cannot be represented and are rejected.
+        """
+        if not isinstance(field, six.string_types) or field.lstrip('-') in ('', '?'):
+            raise ValidationError('Ordering {!r} cannot be paginated with a cursor'.format(field))
+        prefix = '-' if field.startswith('-') else ''
+        names = field.lstrip('-').split(LOOKUP_SEP)
+        for position, name in enumerate(names):
+            if name == 'pk':
+                continue
+            try:
+                model_field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise ValidationError('Ordering {!r} cannot be paginated with a cursor'.format(field))
+            if model_field.many_to_many or model_field.one_to_many:
+                raise ValidationError('Ordering {!r} cannot be paginated with a cursor'.format(field))
+            if model_field.is_relation and position == len(names) - 1:
+                names[position] = model_field.attname
+            elif model_field.is_relation:
+                model = model_field.related_model
+        return prefix + LOOKUP_SEP.join(names)
+
+    def get_total(self, queryset, mode):
+        if mode == 'exact':
+            return queryset.count()
+        if mode not in ('cached', 'approximate'):
+            return None
+        sql, params = queryset.query.sql_with_params()
+        connection = connections[queryset.db]
+        if mode == 'approximate' and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN ' + sql, params)
+                match = EXPLAIN_ROWS_RE.search(cursor.fetchone()[0])
+            if match:
+                return int(match.group(1))
+        key = 'document-count:' + hashlib.md5(force_bytes(sql + repr(params))).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, getattr(settings, 'DOCUMENT_COUNT_CACHE_TIMEOUT', 60))
+        return count
+
+    def row_values(self, row):
+        values = []
+        for field in self.ordering:
+            value = row
+            for attr in field.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            values.append(value.pk if isinstance(value, models.Model) else value)
+        return values
+
+    def invert(self, field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(force_text(base64.urlsafe_b64decode(force_bytes(cursor))))
+            return data['v'], bool(data.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound('Invalid cursor')
+
+    def encode_cursor(self, values, reverse):
+        # isoformat keeps microseconds, which DjangoJSONEncoder would truncate.
+        data = json.dumps({'v': values, 'r': reverse},
+                          default=lambda value: value.isoformat() if hasattr(value, 'isoformat') else force_text(value))
+        return force_text(base64.urlsafe_b64encode(force_bytes(data)))
+
+    def cursor_link(self, values, reverse):
+        if values is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(values, reverse))
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from backend.apps.document.caching import bump_version
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+
+def prefetch_object_perms(files):
+    """Load the object permissions of ``files`` in three queries, like ``prefetch_related``.
+
+    Each file gets a ``{user: set of codenames}`` map, direct and group permissions merged,
+    stored on ``_object_perms`` where ``File.object_perms`` picks it up.
+    """
+    files = list(files)
+    if not files:
+        return files
+    content_type = ContentType.objects.get_for_model(files[0])
+    object_pks = [str(file.pk) for file in files]
+    perms = {object_pk: {} for object_pk in object_pks}
+
+    for user_perm in UserObjectPermission.objects.filter(
+        content_type=content_type, object_pk__in=object_pks,
+    ).select_related('user', 'permission'):
+        perms[user_perm.object_pk].setdefault(user_perm.user, set()).add(user_perm.permission.codename)
+
+    group_perms = list(GroupObjectPermission.objects.filter(
+        content_type=content_type, object_pk__in=object_pks,
+    ).values_list('object_pk', 'group_id', 'permission__codename'))
+    if group_perms:
+        members = {}
+        memberships = get_user_model().groups.through.objects.filter(
+            group_id__in={group_id for object_pk, group_id, codename in group_perms},
+        ).select_related('user')
+        for membership in memberships:
+            members.setdefault(membership.group_id, []).append(membership.user)
+        for object_pk, group_id, codename in group_perms:
+            for user in members.get(group_id, ()):
+                perms[object_pk].setdefault(user, set()).add(codename)
+
+    for file in files:
+        file._object_perms = perms[str(file.pk)]
+    return files
+
+
+def visible_pairs(file_ids=None, user_ids=None, categories=None):
+    """``(user_id, file_id)`` pairs where the user holds the view permission of the file's category.
+
+    Direct and group permissions count; the search can be narrowed to some files or users.
+    Only the files the matching permissions point to are loaded; their ``{file_id: category}``
+    is added to ``categories`` when given.
+    """
+    File = apps.get_model('document', 'File')
+    content_type = ContentType.objects.get_for_model(File)
+    codenames = {'view_{}'.format(category) for category, label in File.CATEGORY_CHOICES}
+    user_perms = UserObjectPermission.objects.filter(content_type=content_type, permission__codename__in=codenames)
+    group_perms = GroupObjectPermission.objects.filter(content_type=content_type, permission__codename__in=codenames)
+    memberships = get_user_model().groups.through.objects.all()
+    if file_ids is not None:
+        object_pks = [str(file_id) for file_id in file_ids]
+        user_perms = user_perms.filter(object_pk__in=object_pks)
+        group_perms = group_perms.filter(object_pk__in=object_pks)
+    if user_ids is not None:
+        user_perms = user_perms.filter(user_id__in=user_ids)
+        memberships = memberships.filter(user_id__in=user_ids)
+        group_perms = group_perms.filter(group_id__in=memberships.values('group_id'))
+    user_perms = list(user_perms.values_list('object_pk', 'user_id', 'permission__codename'))
+    group_perms = list(group_perms.values_list('object_pk', 'group_id', 'permission__codename'))
+
+    referenced = {int(object_pk) for object_pk, holder_id, codename in user_perms + group_perms}
+    files = dict(File.all_objects.filter(pk__in=referenced).values_list('pk', 'category'))
+    if categories is not None:
+        categories.update(files)
+    perms = {str(pk): 'view_{}'.format(category) for pk, category in files.items()}
+
+    pairs = set()
+    for object_pk, user_id, codename in user_perms:
+        if perms.get(object_pk) == codename:
+            pairs.add((user_id, int(object_pk)))
+
+    group_files = {}
+    for object_pk, group_id, codename in group_perms:
+        if perms.get(object_pk) == codename:
+            group_files.setdefault(group_id, []).append(int(object_pk))
+    if group_files:
+        for user_id, group_id in memberships.filter(group_id__in=list(group_files)).values_list('user_id', 'group_id'):
+            pairs.update((user_id, file_id) for file_id in group_files[group_id])
+    return pairs
+
+
+def rebuild_visibility(file_ids=None, user_ids=None, batch_size=1000):
+    """Recompute the visibility index, for everything or only for the given files or users.
+
+    Only the rows that changed are written, and only the categories of their files get a
+    new change version, once the transaction commits.
+    """
+    FileVisibility = apps.get_model('document', 'FileVisibility')
+    rows = FileVisibility.objects.all()
+    if file_ids is not None:
+        rows = rows.filter(file_id__in=file_ids)
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+
+    with transaction.atomic():
+        categories = {}
+        pairs = visible_pairs(file_ids, user_ids, categories)
+        existing = {}
+        for pk, user_id, file_id, category in rows.values_list('pk', 'user_id', 'file_id', 'file__category'):
+            existing[user_id, file_id] = pk
+            categories[file_id] = category
+        removed, added = set(existing) - pairs, pairs - set(existing)
+        removed_pks = [existing[pair] for pair in removed]
+        for start in range(0, len(removed_pks), batch_size):
+            FileVisibility.objects.filter(pk__in=removed_pks[start:start + batch_size]).delete()
+        FileVisibility.objects.bulk_create(
+            [FileVisibility(user_id=user_id, file_id=file_id) for user_id, file_id in added],
+            batch_size=batch_size,
+        )
+        changed = {categories[file_id] for user_id, file_id in removed | added}
+        if changed:
+            transaction.on_commit(lambda: bump_version(*changed))
+    return len(pairs)
+
+
+def filter_visible(user, queryset, perm):
+    """Files of ``queryset`` ``user`` may view, through one join on the visibility index.
+
+    Like ``get_objects_for_user``, a global ``perm`` (or being a superuser) grants everything.
+    """
+    if user.has_perm(perm):
+        return queryset
+    return queryset.filter(visibility__user=user)
+
+
+def bulk_assign_perms(files, model=None, users=(), groups=()):
+    """Give each file's owner its permissions and grant view access to ``users`` and ``groups``.
+
+    Owners get view/change/delete on the file, plus the ``model`` specific ones when given;
+    ``users`` and ``groups`` get the view permissions. Permissions already held are skipped and
+    the rest are written with one ``bulk_create`` per guardian table.
+    """
+    files = list(files)
+    if not files:
+        return
+    owner_codenames = ['view_file', 'delete_file', 'change_file']
+    view_codenames = ['view_file']
+    if model:
+        owner_codenames += ['view_{}'.format(model), 'delete_{}'.format(model), 'change_{}'.format(model)]
+        view_codenames.append('view_{}'.format(model))
+
+    content_type = ContentType.objects.get_for_model(files[0])
+    permissions = {permission.codename: permission for permission in Permission.objects.filter(
+        content_type=content_type, codename__in=owner_codenames,
+    )}
+    missing = set(owner_codenames) - set(permissions)
+    if missing:
+        raise Permission.DoesNotExist('Unknown permissions: {}'.format(', '.join(sorted(missing))))
+
+    user_grants = set()
+    group_grants = set()
+    for file in files:
+        object_pk = str(file.pk)
+        user_grants.update((file.owner_id, object_pk, codename) for codename in owner_codenames)
+        for user in users:
+            user_grants.update((user.pk, object_pk, codename) for codename in view_codenames)
+        for group in groups:
+            group_grants.update((group.pk, object_pk, codename) for codename in view_codenames)
+
+    object_pks = [str(file.pk) for file in files]
+    for model_class, field, grants in ((UserObjectPermission, 'user_id', user_grants),
+                                       (GroupObjectPermission, 'group_id', group_grants)):
+        if not grants:
+            continue
+        existing = set(model_class.objects.filter(
+            content_type=content_type, object_pk__in=object_pks, permission__in=permissions.values(),
+        ).values_list(field, 'object_pk', 'permission__codename'))
+        model_class.objects.bulk_create([
+            model_class(content_type=content_type, object_pk=object_pk, permission=permissions[codename],
+                        **{field: holder_id})
+            for holder_id, object_pk, codename in grants - existing
+        ])
+
+    rebuild_visibility(file_ids=[file.pk for file in files])
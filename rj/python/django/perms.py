@@ -1,30 +1,72 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import re
+
 import magic
 from backend.apps.document.models import Document
-from backend.apps.auth.models import SecureToken
 from backend.apps.document import models, serializers
+from backend.apps.document.caching import ConditionalResponseMixin
+from backend.apps.document.exports import export_response
+from backend.apps.document.paging import KeysetPagination
+from backend.apps.document.permissions import bulk_assign_perms, filter_visible, prefetch_object_perms
+from backend.apps.document.search import FullTextSearchFilter
+from backend.apps.document.tokens import resolve_token
 from backend.apps.mixins.filters import CamelCaseOrderingFilter
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, StreamingHttpResponse
 from django.views.generic import View
 from django.views.generic.detail import SingleObjectMixin
-from guardian.shortcuts import get_objects_for_user
 from rest_framework import viewsets, pagination, filters, generics, response
+from rest_framework.decorators import list_route
 
 User = get_user_model()
 
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """Return the ``(start, end)`` byte positions of a single-range header, None to send it all.
+
+    Raises ValueError for a range that cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError('Unsatisfiable range')
+    return start, end
+
+
+def read_chunks(file, start, length, block_size):
+    file.open('rb')
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(block_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
 
 class DocumentDownloadView(SingleObjectMixin, View):
     permission_required = 'document.view_document'
     queryset = models.Document.objects.all()
 
     def get(self, request, *args, **kwargs):
-        token = kwargs.get('token')
-        try:
-            token = SecureToken.objects.active().get(token=token, category=SecureToken.DOWNLOAD)
-        except SecureToken.DoesNotExist:
+        token = resolve_token(kwargs.get('token'))
+        if token is None:
             raise Http404
 
         user = token.user
@@ -34,11 +76,45 @@ class DocumentDownloadView(SingleObjectMixin, View):
             raise Http404
 
         document.log_download(user)
-        content_type = magic.from_file(document.file.file.name, mime=True)
-        response = HttpResponse(document.file, content_type=content_type)
+        content_type = document.mime_type or magic.from_file(document.file.path, mime=True)
+        accel = getattr(settings, 'DOCUMENT_DOWNLOAD_ACCEL', None)
+        if accel:
+            response = self.accel_response(document, accel, content_type)
+        else:
+            response = self.stream_response(request, document, content_type)
         response['Content-Disposition'] = 'attachment; filename="{}"'.format(document.filename)
         return response
 
+    def accel_response(self, document, accel, content_type):
+        # The front proxy serves the bytes (and any Range requests) itself.
+        response = HttpResponse(content_type=content_type)
+        if accel == 'x-accel-redirect':
+            root = getattr(settings, 'DOCUMENT_DOWNLOAD_ACCEL_ROOT', '/protected/')
+            response['X-Accel-Redirect'] = root + document.file.name
+        else:
+            response['X-Sendfile'] = document.file.path
+        return response
+
+    def stream_response(self, request, document, content_type):
+        size = document.size
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+
+        start, end = byte_range or (0, size - 1)
+        block_size = getattr(settings, 'DOCUMENT_DOWNLOAD_BLOCK_SIZE', 64 * 1024)
+        response = StreamingHttpResponse(read_chunks(document.file, start, end - start + 1, block_size),
+                                         content_type=content_type)
+        if byte_range:
+            response.status_code = 206
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+        response['Content-Length'] = end - start + 1
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
 
 class DocumentDownloadRetrieveView(generics.RetrieveAPIView):
     serializer_class = serializers.DocumentMetaSerializer
@@ -49,46 +125,81 @@ class DocumentDownloadRetrieveView(generics.RetrieveAPIView):
     permission_classes = []
 
     def get(self, request, *args, **kwargs):
-        token = kwargs.get('token')
-
-        try:
-            token = SecureToken.objects.get(token=token, category=SecureToken.DOWNLOAD)
-            request.user = token.user
-        except SecureToken.DoesNotExist:
+        token = resolve_token(kwargs.get('token'))
+        if token is None:
             return response.Response('invalid token')
+        request.user = token.user
 
         return super(DocumentDownloadRetrieveView, self).get(request, *args, **kwargs)
 
 
-class DocumentViewSet(viewsets.ModelViewSet):
+class DocumentViewSet(ConditionalResponseMixin, viewsets.ModelViewSet):
     serializer_class = serializers.DocumentSerializer
     queryset = models.Document.objects.all()
-    filter_backends = (CamelCaseOrderingFilter, filters.SearchFilter, filters.DjangoFilterBackend,)
-    pagination_class = pagination.LimitOffsetPagination
+    filter_backends = (CamelCaseOrderingFilter, FullTextSearchFilter, filters.DjangoFilterBackend,)
+    pagination_class = KeysetPagination
     model = 'document'
+    category = models.File.DOCUMENT
+    view_perm = 'document.view_document'
     filter_fields = ['sticky']
 
     def get_queryset(self):
-        qs = get_objects_for_user(self.request.user, 'view_{}'.format(self.model), klass=models.Document.objects.all())
-        return qs
+        return filter_visible(self.request.user, self.queryset.select_related('owner'), self.view_perm)
 
     def filter_queryset(self, queryset):
         view_access = self.request.query_params.get('viewAccess', 0)
-        user = User.objects.get(id=view_access) if User.objects.filter(id=view_access).exists() else None
+        user = User.objects.filter(id=view_access).first()
         if user and user == self.request.user:
             queryset = queryset.exclude(owner=user)
         elif user:
-            queryset = get_objects_for_user(user, 'view_{}'.format(self.model), klass=queryset)
+            queryset = filter_visible(user, queryset, self.view_perm)
 
         if 'owner' in self.request.query_params:
             queryset = queryset.filter(owner=self.request.user)
 
         return super(DocumentViewSet, self).filter_queryset(queryset)
 
+    @list_route(methods=['get'])
+    def export(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        return export_response(
+            queryset,
+            ('id', 'name', 'category', 'owner__email', 'created_at', 'modified_at', 'file_size', 'checksum'),
+            filename='{}s'.format(self.model),
+            output=request.query_params.get('output'),
+            compress='gzip' in request.query_params,
+            header=('id', 'name', 'category', 'owner', 'created_at', 'modified_at', 'size', 'checksum'),
+        )
+
+    @list_route(methods=['get'], url_path='export-logs')
+    def export_logs(self, request):
+        """Logs of the listed files; only staff see the logs of files owned by someone else."""
+        files = self.filter_queryset(self.get_queryset())
+        if not request.user.is_staff:
+            files = files.filter(owner=request.user)
+        files = files.order_by().values('pk')
+        logs = models.FileLog.objects.filter(file__in=files).order_by('file', 'datetime')
+        if 'type' in request.query_params:
+            logs = logs.filter(type__in=request.query_params.getlist('type'))
+        return export_response(
+            logs,
+            ('file_id', 'file__name', 'type', 'user__email', 'datetime'),
+            filename='{}-logs'.format(self.model),
+            output=request.query_params.get('output'),
+            compress='gzip' in request.query_params,
+            header=('file', 'name', 'type', 'user', 'datetime'),
+        )
+
+    def paginate_queryset(self, queryset):
+        page = super(DocumentViewSet, self).paginate_queryset(queryset)
+        if page is not None:
+            prefetch_object_perms(page)
+        return page
+
     def perform_create(self, serializer):
         instance = serializer.save()
         instance.log_create(self.request.user)
-        instance.set_owner_perms(self.model)
+        bulk_assign_perms([instance], model=instance.category)
 
     def perform_destroy(self, instance):
         instance.log_delete(self.request.user)
@@ -103,24 +214,21 @@ class PromotionViewSet(DocumentViewSet):
     serializer_class = serializers.PromotionSerializer
     queryset = models.Promotion.objects.all()
     model = 'promotion'
-
-    def get_queryset(self):
-        return get_objects_for_user(self.request.user, 'view_promotion', klass=models.Promotion.objects.all())
+    category = models.File.PROMOTION
+    view_perm = 'document.view_promotion'
 
 
 class PostViewSet(DocumentViewSet):
     serializer_class = serializers.PostSerializer
     queryset = models.Post.objects.all()
     model = 'post'
-
-    def get_queryset(self):
-        return get_objects_for_user(self.request.user, 'view_post', klass=models.Post.objects.all())
+    category = models.File.POST
+    view_perm = 'document.view_post'
 
 
 class PriceListViewSet(DocumentViewSet):
     serializer_class = serializers.PriceListSerializer
     queryset = models.PriceList.objects.all()
     model = 'price'
-
-    def get_queryset(self):
-        return get_objects_for_user(self.request.user, 'view_pricelist', klass=models.PriceList.objects.all())
+    category = models.File.PRICE_LIST
+    view_perm = 'document.view_pricelist'
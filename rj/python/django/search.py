@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+from functools import reduce
+from operator import and_, or_
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchBackend(object):
+    """Search without an index: every word must be contained in one of ``fields``.
+
+    This is what ``SearchFilter`` does over the same fields; it serves databases without
+    full-text support, so ``index`` and ``remove`` do nothing and there is no table to create.
+    """
+    table = 'document_file_search'
+    fields = ('name', 'short_description', 'description')
+
+    def create_sql(self):
+        """Statements creating the index, run by the ``0002_file_search_index`` migration."""
+        return []
+
+    def drop_sql(self):
+        return []
+
+    def index(self, file):
+        pass
+
+    def remove(self, file_id):
+        pass
+
+    def update(self, file):
+        if file.is_delete:
+            self.remove(file.pk)
+        else:
+            self.index(file)
+
+    def words(self, query):
+        return query.replace(',', ' ').split()
+
+    def filter(self, queryset, query, rank=True):
+        """``queryset`` narrowed to the files matching ``query``, best match first when ``rank``."""
+        return queryset.filter(reduce(and_, [
+            reduce(or_, [Q(**{'{}__icontains'.format(field): word}) for field in self.fields])
+            for word in self.words(query)
+        ]))
+
+
+class IndexedSearchBackend(SearchBackend):
+    """Inverted index over the searchable text of files, one row per file keyed by its id."""
+
+    def execute(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def words(self, query):
+        return WORD_RE.findall(query)
+
+    def match_sql(self, query):
+        """``(sql, params)`` selecting the ids of files matching ``query``, for a subquery."""
+        raise NotImplementedError
+
+    def rank_sql(self, query, column):
+        """``(sql, params)`` ranking the file whose id is in ``column``, lower is better."""
+        raise NotImplementedError
+
+    def filter(self, queryset, query, rank=True):
+        queryset = queryset.filter(pk__in=RawSQL(*self.match_sql(query)))
+        if rank:
+            meta = queryset.model._meta
+            column = '{}.{}'.format(connection.ops.quote_name(meta.db_table), connection.ops.quote_name(meta.pk.column))
+            queryset = queryset.annotate(
+                search_rank=RawSQL(*self.rank_sql(query, column), output_field=FloatField())
+            ).order_by('search_rank')
+        return queryset
+
+
+class SQLiteSearchBackend(IndexedSearchBackend):
+    weights = (10.0, 5.0, 1.0)
+
+    def create_sql(self):
+        return ['CREATE VIRTUAL TABLE {} USING fts5({})'.format(self.table, ', '.join(self.fields))]
+
+    def drop_sql(self):
+        return ['DROP TABLE {}'.format(self.table)]
+
+    def index(self, file):
+        self.remove(file.pk)
+        self.execute('INSERT INTO {} (rowid, {}) VALUES (%s, {})'.format(
+            self.table, ', '.join(self.fields), ', '.join(['%s'] * len(self.fields))),
+            [file.pk] + [getattr(file, field) for field in self.fields])
+
+    def remove(self, file_id):
+        self.execute('DELETE FROM {} WHERE rowid = %s'.format(self.table), [file_id])
+
+    def match_sql(self, query):
+        return 'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(self.table), [self.match(self.words(query))]
+
+    def rank_sql(self, query, column):
+        return 'SELECT {1} FROM {0} WHERE {0} MATCH %s AND rowid = {2}'.format(
+            self.table, self.bm25(), column), [self.match(self.words(query))]
+
+    def match(self, words):
+        return ' '.join('"{}"*'.format(word) for word in words)
+
+    def bm25(self):
+        return 'bm25({}, {})'.format(self.table, ', '.join(str(weight) for weight in self.weights))
+
+
+class PostgresSearchBackend(IndexedSearchBackend):
+    config = 'simple'
+    weights = ('A', 'B', 'C')
+
+    def create_sql(self):
+        return [
+            'CREATE TABLE {0} (file_id integer PRIMARY KEY, vector tsvector)'.format(self.table),
+            'CREATE INDEX {0}_vector ON {0} USING gin (vector)'.format(self.table),
+        ]
+
+    def drop_sql(self):
+        return ['DROP TABLE {}'.format(self.table)]
+
+    def index(self, file):
+        vector = ' || '.join("setweight(to_tsvector('{}', %s), '{}')".format(self.config, weight)
+                             for weight in self.weights)
+        self.execute(
+            'INSERT INTO {0} (file_id, vector) VALUES (%s, {1}) '
+            'ON CONFLICT (file_id) DO UPDATE SET vector = EXCLUDED.vector'.format(self.table, vector),
+            [file.pk] + [getattr(file, field) for field in self.fields])
+
+    def remove(self, file_id):
+        self.execute('DELETE FROM {} WHERE file_id = %s'.format(self.table), [file_id])
+
+    def match_sql(self, query):
+        return "SELECT file_id FROM {0} WHERE vector @@ to_tsquery('{1}', %s)".format(
+            self.table, self.config), [self.tsquery(self.words(query))]
+
+    def rank_sql(self, query, column):
+        return "SELECT -ts_rank(vector, to_tsquery('{1}', %s)) FROM {0} WHERE file_id = {2}".format(
+            self.table, self.config, column), [self.tsquery(self.words(query))]
+
+    def tsquery(self, words):
+        return ' & '.join('{}:*'.format(word) for word in words)
+
+
+def _has_fts5(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            return bool(cursor.fetchone()[0])
+    except DatabaseError:
+        return False
+
+
+def backend_for(connection):
+    """The search backend ``connection`` supports, ``DOCUMENT_SEARCH_BACKEND`` if set."""
+    path = getattr(settings, 'DOCUMENT_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite' and _has_fts5(connection):
+        return SQLiteSearchBackend()
+    return SearchBackend()
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = backend_for(connection)
+    return _backend
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """Drop-in replacement for ``SearchFilter`` answering ``search`` from the full-text index.
+
+    Matches are ranked by relevance unless the request asks for an explicit ordering. The
+    index is queried as a subquery of ``queryset``, so permission filters and counts apply
+    to every match rather than to the best ranked ones. Without full-text support in the
+    database, words are matched with ``icontains`` as ``SearchFilter`` does.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        backend = get_backend()
+        if not backend.words(query):
+            return queryset.none()
+        return backend.filter(queryset, query, rank=api_settings.ORDERING_PARAM not in request.query_params)
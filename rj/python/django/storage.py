@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import errno
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, get_storage_class
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage keeping every distinct content once, as a blob named by its SHA-256.
+
+    Uploads are hashed while they are written to the blob directory (or not read at all when
+    the content carries its ``sha256`` and the blob exists); the requested name is
+    then created as a hard link to the blob, so names, sizes, paths and X-Sendfile /
+    X-Accel-Redirect downloads behave as with ``FileSystemStorage``. Deleting a name only
+    removes its link; blobs are removed by the ``collect_file_blobs`` command once no row
+    references them.
+    """
+    blob_dir = 'blobs'
+
+    def blob_name(self, digest):
+        return '/'.join((self.blob_dir, digest[:2], digest[2:4], digest))
+
+    def _save(self, name, content):
+        # Content hashed by its model carries the digest: an existing blob is linked unread.
+        digest = getattr(content, 'sha256', None)
+        if digest:
+            try:
+                return self._link(self.path(self.blob_name(digest)), name)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    raise
+
+        temp_path, digest = self._write_temp(content)
+        try:
+            blob_path = self.path(self.blob_name(digest))
+            # Link first: the blob may be collected at any time until a name links to it,
+            # in which case the upload itself becomes the blob.
+            try:
+                return self._link(blob_path, name)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    raise
+            self._makedirs(os.path.dirname(blob_path))
+            os.rename(temp_path, blob_path)
+            if self.file_permissions_mode is not None:
+                os.chmod(blob_path, self.file_permissions_mode)
+            return self._link(blob_path, name)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _write_temp(self, content):
+        """Stream ``content`` to a temporary file next to the blobs; returns its path and digest."""
+        digest = hashlib.sha256()
+        temp_dir = self.path(self.blob_dir)
+        self._makedirs(temp_dir)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        return temp_path, digest.hexdigest()
+
+    def _link(self, blob_path, name):
+        """Create ``name`` (or the next available name) as a hard link to ``blob_path``."""
+        while True:
+            path = self.path(name)
+            self._makedirs(os.path.dirname(path))
+            try:
+                os.link(blob_path, path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+                name = self.get_available_name(name)
+            else:
+                return name.replace('\\', '/')
+
+    def _makedirs(self, directory):
+        try:
+            os.makedirs(directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+
+    def adopt(self, name):
+        """Move the content of ``name``, stored before deduplication, into a blob."""
+        path = self.path(name)
+        if os.stat(path).st_nlink > 1:
+            return False
+        with self.open(name) as content:
+            alias = self._save(name + '.adopt', content)
+        os.rename(self.path(alias), path)
+        return True
+
+    def blobs(self):
+        """``(digest, path)`` of every stored blob."""
+        root = self.path(self.blob_dir)
+        for directory, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                if len(filename) == 64 and directory != root:
+                    yield filename, os.path.join(directory, filename)
+
+
+document_storage = get_storage_class(getattr(
+    settings, 'DOCUMENT_FILE_STORAGE', 'backend.apps.document.storage.ContentAddressedStorage'))()
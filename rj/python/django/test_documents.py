@@ -0,0 +1,821 @@
+import asyncore
+import glob
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import smtpd
+import socket
+import threading
+import time
+import zipfile
+from datetime import timedelta
+
+import pytest
+
+from django.contrib.auth.models import Group
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Q
+from django.db.models.signals import post_save
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.six.moves.urllib.parse import parse_qs, urlparse
+from guardian.shortcuts import assign_perm, remove_perm
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from backend.apps.auth.models import SecureToken, User
+from backend.apps.document import tokens
+from backend.apps.document.benchmarks import bench_hot_paths, check_budgets
+from backend.apps.document.caching import ConditionalResponseMixin, PageCache, check_version_cache, get_version
+from backend.apps.document.exports import export_response
+from backend.apps.document.management.commands import send_reminders
+from backend.apps.document.instrumentation import instrument, registry, render_metrics
+from backend.apps.document.mail import MailDispatcher, build_message
+from backend.apps.document.models import Document, File, FileLog, FileLogCounter, FileLogWriter, NotificationJob
+from backend.apps.document.paging import KeysetPagination
+from backend.apps.document.permissions import (
+    bulk_assign_perms, filter_visible, prefetch_object_perms, rebuild_visibility,
+)
+from backend.apps.document.search import FullTextSearchFilter
+from backend.apps.document.tokens import active_until, cache_timeout, resolve_token
+from backend.apps.document.views import (
+    DocumentDownloadRetrieveView, DocumentDownloadView, DocumentViewSet, parse_range,
+)
+
+
+class StandInSMTPServer(smtpd.SMTPServer):
+    def __init__(self, *args, **kwargs):
+        smtpd.SMTPServer.__init__(self, *args, **kwargs)
+        self.connections = 0
+        self.recipients = []
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.recipients.extend(rcpttos)
+
+
+@pytest.fixture
+def smtp_server(settings):
+    server = StandInSMTPServer(('127.0.0.1', 0), None)
+    thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1})
+    thread.daemon = True
+    thread.start()
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    settings.EMAIL_HOST, settings.EMAIL_PORT = server.socket.getsockname()
+    yield server
+    server.close()
+    thread.join()
+
+
+def make_document(recipients):
+    owner = User.objects.create(username='owner', email='owner@example.com')
+    document = Document.objects.create(name='document', owner=owner, notify=True)
+    document.log_create(owner)
+    group = Group.objects.create(name='Readers')
+    for i in range(recipients):
+        user = User.objects.create(username='user{}'.format(i), email='user{}@example.com'.format(i))
+        if i % 2:
+            user.groups.add(group)
+        else:
+            assign_perm('document.view_document', user, document)
+    assign_perm('document.view_document', group, document)
+    return document
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('recipients', [1, 10, 100])
+def test_recipients_query_count(recipients, django_assert_num_queries):
+    document = make_document(recipients)
+    with django_assert_num_queries(1):
+        users = document.get_recipients(perm='view_document')
+    assert len(users) == recipients
+
+
+@pytest.mark.django_db
+def test_recipients_skip_downloaded_and_over_notified():
+    document = make_document(3)
+    downloaded, notified, pending = User.objects.exclude(pk=document.owner_id).order_by('username')
+    document.log_download(downloaded)
+    for _ in range(3):
+        document.log_notify(notified)
+
+    assert set(document.get_recipients(perm='view_document')) == {notified, pending}
+    assert document.get_recipients(perm='view_document', notify_count=2) == [pending]
+    assert FileLog.objects.filter(file=document, type=FileLog.NOTIFY).count() == 3
+
+
+@pytest.mark.django_db
+def test_download_urls_reuse_active_tokens(django_assert_num_queries):
+    document = make_document(20)
+    users = document.get_recipients(perm='view_document')
+    existing = document.frontend_download_url(users[0])
+
+    with django_assert_num_queries(3):
+        urls = document.download_urls(users)
+
+    assert urls[users[0]] == existing
+    assert len(set(urls.values())) == len(users)
+
+
+@pytest.mark.django_db
+def test_dispatcher_reuses_one_connection(smtp_server):
+    document = make_document(25)
+    users = document.get_recipients(perm='view_document')
+    messages = [(user, build_message(user, 'subject', 'message', '<p>message</p>')) for user in users]
+
+    delivered = MailDispatcher(batch_size=10).send(messages)
+
+    assert delivered == users
+    assert smtp_server.connections == 1
+    assert sorted(smtp_server.recipients) == sorted(user.email for user in users)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_notify_logs_only_delivered(settings):
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    settings.EMAIL_HOST, settings.EMAIL_PORT = '127.0.0.1', 1
+    document = make_document(3)
+
+    document.notify_receiver(document.DOCUMENT_REMINDER)
+
+    assert not FileLog.objects.filter(file=document, type=FileLog.NOTIFY).exists()
+
+
+class RecordingConnection(object):
+    def __init__(self, fail_open=False):
+        self.fail_open = fail_open
+        self.batches = []
+
+    def open(self):
+        if self.fail_open:
+            raise socket.error('refused')
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        self.batches.append(list(messages))
+        return len(messages)
+
+
+@pytest.mark.django_db
+def test_dispatcher_sends_each_batch_in_one_call():
+    document = make_document(25)
+    users = document.get_recipients(perm='view_document')
+    messages = [(user, build_message(user, 'subject', 'message')) for user in users]
+    connection = RecordingConnection()
+
+    delivered = MailDispatcher(batch_size=10, connection=connection).send(messages)
+
+    assert delivered == users
+    assert [len(batch) for batch in connection.batches] == [10, 10, 5]
+
+
+@pytest.mark.django_db
+def test_dispatcher_raises_when_the_connection_cannot_open():
+    document = make_document(1)
+    user = document.get_recipients(perm='view_document')[0]
+    with pytest.raises(socket.error):
+        MailDispatcher(connection=RecordingConnection(fail_open=True)).send([(user, build_message(user, 's', 'm'))])
+
+
+@pytest.mark.django_db(transaction=True)
+def test_notify_logs_delivered_recipients(smtp_server):
+    document = make_document(3)
+    users = document.get_recipients(perm='view_document')
+
+    document.notify_receiver(document.DOCUMENT_REMINDER)
+
+    logged = FileLog.objects.filter(file=document, type=FileLog.NOTIFY).values_list('user_id', flat=True)
+    assert sorted(logged) == sorted(user.pk for user in users)
+    assert sorted(smtp_server.recipients) == sorted(user.email for user in users)
+
+
+@pytest.mark.django_db
+def test_enqueue_deduplicates_pending_jobs():
+    document = make_document(1)
+    first = document.enqueue_notification('notify_receiver', document.DOCUMENT_CHANGED)
+    second = document.enqueue_notification('notify_receiver', document.DOCUMENT_CHANGED)
+    assert first == second
+
+    assert first.claim()
+    first.run()
+    third = document.enqueue_notification('notify_receiver', document.DOCUMENT_CHANGED)
+    assert third != first
+    assert NotificationJob.latency_percentile(95) is not None
+
+
+@pytest.mark.django_db
+def test_timestamps_follow_logs(django_assert_num_queries):
+    document = make_document(1)
+    created_at = document.created_at
+    document.log_modify(document.owner)
+    document = Document.objects.get(pk=document.pk)
+
+    with django_assert_num_queries(0):
+        assert document.created_at == created_at
+        assert document.modified_at > created_at
+
+
+@pytest.mark.django_db
+def test_full_save_keeps_timestamps_of_later_logs():
+    document = make_document(1)
+    stale = Document.objects.get(pk=document.pk)
+    document.log_modify(document.owner)
+    stale.delete()
+
+    stale.refresh_from_db()
+    assert stale.is_delete
+    assert stale.modified_at == document.modified_at
+
+
+@pytest.mark.django_db(transaction=True)
+def test_log_writer_flushes_in_bulk():
+    document = make_document(20)
+    users = document.get_recipients(perm='view_document')
+    flushed = FileLogWriter.counters['flushed']
+
+    queries = []
+    for batch in (users[:2], users[2:]):
+        with CaptureQueriesContext(connection) as context:
+            with FileLogWriter.buffered():
+                for user in batch:
+                    document.log_notify(user)
+        queries.append(len(context))
+
+    assert queries[0] == queries[1]
+    assert FileLog.objects.filter(file=document, type=FileLog.NOTIFY).count() == 20
+    assert FileLogWriter.counters['flushed'] - flushed == 20
+
+
+@pytest.mark.django_db(transaction=True)
+def test_log_writer_keeps_notify_logs_of_a_failed_block():
+    document = make_document(1)
+    user = document.get_recipients(perm='view_document')[0]
+    saved = []
+    receiver = lambda sender, instance, created, **kwargs: saved.append(instance.type)
+    post_save.connect(receiver, sender=FileLog)
+    try:
+        with pytest.raises(ValueError):
+            with FileLogWriter.buffered():
+                document.log_notify(user)
+                document.log_download(user)
+                raise ValueError
+    finally:
+        post_save.disconnect(receiver, sender=FileLog)
+
+    assert list(FileLog.objects.filter(file=document, user=user).values_list('type', flat=True)) == [FileLog.NOTIFY]
+    assert saved == [FileLog.NOTIFY]
+
+
+@pytest.mark.django_db
+def test_log_writer_synchronous_mode(settings):
+    settings.FILE_LOG_BUFFERED = False
+    document = make_document(1)
+    with FileLogWriter.buffered():
+        document.log_download(document.owner)
+        assert FileLog.objects.filter(file=document, type=FileLog.DOWNLOAD).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_counters_follow_logs():
+    document = make_document(1)
+    user = document.get_recipients(perm='view_document')[0]
+    document.log_notify(user)
+    document.log_notify(user)
+    with FileLogWriter.buffered():
+        document.log_notify(user)
+
+    counter = FileLogCounter.objects.get(file=document, user=user, type=FileLog.NOTIFY)
+    assert counter.count == 3
+    assert counter.last_seen >= FileLog.objects.filter(file=document).latest('datetime').datetime
+
+
+@pytest.mark.parametrize('header,expected', [
+    (None, None),
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-', (100, 999)),
+    ('bytes=-50', (950, 999)),
+    ('bytes=990-2000', (990, 999)),
+    pytest.param('bytes=1000-', None, marks=pytest.mark.xfail(raises=ValueError)),
+    pytest.param('bytes=50-10', None, marks=pytest.mark.xfail(raises=ValueError)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.django_db
+def test_prefetch_object_perms(django_assert_num_queries):
+    document = make_document(6)
+    others = [Document.objects.create(name='other{}'.format(i), owner=document.owner) for i in range(10)]
+    for other in others:
+        other.set_owner_perms()
+    files = list(Document.objects.all())
+
+    with django_assert_num_queries(3):
+        prefetch_object_perms(files)
+        access = {file.pk: file.view_access for file in files}
+
+    assert len(access[document.pk]) == 6
+    assert all(access[other.pk] == [] for other in others)
+
+
+@pytest.mark.django_db
+def test_visibility_follows_permissions():
+    document = make_document(4)
+    direct, grouped = User.objects.filter(username__in=['user0', 'user1']).order_by('username')
+    assert set(document.visibility.values_list('user', flat=True)) == {
+        user.pk for user in User.objects.filter(username__startswith='user')
+    }
+
+    remove_perm('document.view_document', direct, document)
+    grouped.groups.clear()
+
+    visible = set(document.visibility.values_list('user', flat=True))
+    assert direct.pk not in visible
+    assert grouped.pk not in visible
+    assert rebuild_visibility() >= len(visible)
+
+
+@pytest.mark.django_db
+def test_clearing_a_group_rebuilds_only_its_members(monkeypatch):
+    document = make_document(4)
+    group = Group.objects.get(name='Readers')
+    members = set(group.user_set.values_list('pk', flat=True))
+    calls = []
+    monkeypatch.setattr('backend.apps.document.models.rebuild_visibility',
+                        lambda **kwargs: calls.append(kwargs) or rebuild_visibility(**kwargs))
+
+    group.user_set.clear()
+
+    assert [set(call['user_ids']) for call in calls] == [members]
+    assert not members & set(document.visibility.values_list('user', flat=True))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_visibility_changes_bump_only_their_categories():
+    document = make_document(1)
+    reader = User.objects.create(username='reader', email='reader@example.com')
+    versions = {category: get_version(category) for category in (File.DOCUMENT, File.POST)}
+
+    rebuild_visibility()
+    assert {category: get_version(category) for category in versions} == versions
+
+    assign_perm('document.view_document', reader, document)
+    assert get_version(File.DOCUMENT) != versions[File.DOCUMENT]
+    assert get_version(File.POST) == versions[File.POST]
+
+
+@pytest.mark.django_db
+def test_bulk_assign_perms(django_assert_max_num_queries):
+    owner = User.objects.create(username='owner', email='owner@example.com')
+    viewer = User.objects.create(username='viewer', email='viewer@example.com')
+    files = [Document.objects.create(name='document{}'.format(i), owner=owner) for i in range(50)]
+
+    with django_assert_max_num_queries(12):
+        bulk_assign_perms(files, model='document', users=[viewer])
+    bulk_assign_perms(files, model='document', users=[viewer])
+
+    assert all(viewer.has_perm('document.view_document', file) for file in files)
+    assert all(owner.has_perm('document.change_document', file) for file in files)
+    assert set(Document.objects.filter(visibility__user=viewer)) == set(files)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('ordering', [
+    ('-created_at',), ('name', '-created_at'), ('owner',), ('created_at',), ('-modified_at', 'name'),
+])
+def test_keyset_pagination_walks_every_row(ordering):
+    owner = User.objects.create(username='owner', email='owner@example.com')
+    for i in range(25):
+        document = Document.objects.create(name='document{}'.format(i % 4), owner=owner)
+        if i % 3:
+            # The others keep NULL timestamps, like rows never logged.
+            document.log_create(owner)
+    queryset = Document.objects.order_by(*ordering)
+    paginator = KeysetPagination()
+
+    seen, cursor = [], ''
+    while cursor is not None:
+        request = Request(APIRequestFactory().get('/documents/', {'cursor': cursor, 'limit': 7}))
+        seen.extend(paginator.paginate_queryset(queryset, request))
+        next_link = paginator.get_paginated_response([]).data['next']
+        cursor = parse_qs(urlparse(next_link).query)['cursor'][0] if next_link else None
+
+    assert seen == list(queryset.order_by(*paginator.ordering))
+
+
+def test_keyset_ordering_compares_relations_by_key():
+    paginator = KeysetPagination()
+
+    assert paginator.get_ordering(Document.objects.order_by('-owner')) == ['-owner_id', '-pk']
+    assert paginator.get_ordering(Document.objects.order_by('owner__username')) == ['owner__username', 'pk']
+    for ordering in (F('name').desc(), '?', 'visibility__user'):
+        with pytest.raises(ValidationError):
+            paginator.get_ordering(Document.objects.order_by(ordering))
+
+
+@pytest.mark.django_db
+def test_full_text_search_ranks_and_skips_deleted():
+    owner = User.objects.create(username='owner', email='owner@example.com')
+    in_name = Document.objects.create(name='Spring price-list', owner=owner)
+    in_description = Document.objects.create(name='Catalogue', description='spring offer', owner=owner)
+    deleted = Document.objects.create(name='Spring promotion', owner=owner)
+    deleted.delete()
+    Document.objects.create(name='Autumn price-list', owner=owner)
+
+    request = Request(APIRequestFactory().get('/documents/', {'search': 'spri'}))
+    results = FullTextSearchFilter().filter_queryset(request, Document.all_objects.all(), None)
+
+    assert list(results) == [in_name, in_description]
+
+
+@pytest.mark.django_db
+def test_full_text_search_finds_visible_match_below_hidden_ones():
+    owner = User.objects.create(username='owner', email='owner@example.com')
+    reader = User.objects.create(username='reader', email='reader@example.com')
+    for i in range(1001):
+        Document.objects.create(name='Spring price-list {}'.format(i), owner=owner)
+    visible = Document.objects.create(name='Catalogue', description='spring offer', owner=owner)
+    assign_perm('document.view_document', reader, visible)
+
+    request = Request(APIRequestFactory().get('/documents/', {'search': 'spring'}))
+    queryset = filter_visible(reader, Document.objects.all(), 'document.view_document')
+    results = FullTextSearchFilter().filter_queryset(request, queryset, None)
+
+    assert list(results) == [visible]
+    assert results.count() == 1
+
+
+def test_if_modified_since_misses_changes_within_the_second():
+    mixin = ConditionalResponseMixin()
+    request = APIRequestFactory().get('/documents/', HTTP_IF_MODIFIED_SINCE=http_date(1000))
+
+    assert mixin.not_modified(request, '"etag"', 999.5)
+    assert not mixin.not_modified(request, '"etag"', 1000.0)
+    assert not mixin.not_modified(request, '"etag"', 1000.5)
+
+
+def test_page_cache_evicts_least_recently_used():
+    cache = PageCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+
+
+@pytest.mark.parametrize('backend,errors', [
+    ('django.core.cache.backends.locmem.LocMemCache', ['document.E001']),
+    ('django.core.cache.backends.filebased.FileBasedCache', []),
+])
+def test_version_cache_must_be_shared(settings, tmpdir, backend, errors):
+    settings.CACHES = dict(settings.CACHES, versions={'BACKEND': backend, 'LOCATION': str(tmpdir)})
+    settings.DOCUMENT_VERSION_CACHE = 'versions'
+    assert [error.id for error in check_version_cache()] == errors
+
+
+@pytest.mark.django_db(transaction=True)
+def test_version_bumps_on_logs_and_permissions():
+    document = make_document(1)
+    version = get_version(document.category)
+    document.log_modify(document.owner)
+    modified = get_version(document.category)
+    assert modified != version
+
+    assign_perm('document.view_document', document.owner, document)
+    assert get_version(document.category) != modified
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('compress', [False, True])
+def test_export_streams_every_row(compress):
+    owner = User.objects.create(username='owner', email='owner@example.com')
+    for i in range(5):
+        Document.objects.create(name='document{}'.format(i), owner=owner)
+
+    response = export_response(Document.objects.order_by('pk'), ('id', 'name'), 'documents',
+                               output='json', compress=compress)
+    content = b''.join(response.streaming_content)
+    if compress:
+        content = gzip.GzipFile(fileobj=io.BytesIO(content)).read()
+
+    assert json.loads(content.decode('utf-8')) == [
+        {'id': document.pk, 'name': document.name} for document in Document.objects.order_by('pk')
+    ]
+
+
+@pytest.mark.django_db
+def test_export_logs_is_limited_to_owned_files():
+    document = make_document(1)
+    viewer = document.get_recipients(perm='view_document')[0]
+    document.log_download(viewer)
+    view = DocumentViewSet.as_view({'get': 'export_logs'})
+
+    rows = []
+    for user in (viewer, document.owner):
+        request = APIRequestFactory().get('/documents/export-logs/', {'output': 'json'})
+        force_authenticate(request, user=user)
+        response = view(request)
+        rows.append(json.loads(b''.join(response.streaming_content).decode('utf-8')))
+
+    assert rows[0] == []
+    assert viewer.email in [row['user'] for row in rows[1]]
+
+
+@pytest.mark.django_db
+def test_instrument_records_queries_and_slow_sql(settings, caplog):
+    settings.DOCUMENT_INSTRUMENTATION = True
+    settings.DOCUMENT_SLOW_THRESHOLD = 0
+    registry.pop('test.block', None)
+    with instrument('test.block'):
+        User.objects.count()
+        User.objects.exists()
+
+    assert registry['test.block']['calls'] == 1
+    assert registry['test.block']['queries'] == 2
+    assert registry['test.block']['slow'] == 1
+    assert 'document_queries_total{name="test.block"} 2' in render_metrics()
+    assert json.loads(caplog.records[-1].getMessage())['sql'][0].startswith('SELECT COUNT(*)')
+
+
+@pytest.mark.django_db
+def test_instrument_counts_queries_once_the_log_is_full(settings):
+    settings.DOCUMENT_INSTRUMENTATION = True
+    registry.pop('test.full', None)
+    connection.queries_log.extend({'sql': 'SELECT 1', 'time': '0.000'} for _ in range(connection.queries_limit))
+    with instrument('test.full'):
+        User.objects.count()
+
+    assert registry['test.full']['queries'] == 1
+    assert not connection.queries_log
+
+
+@pytest.mark.django_db
+def test_instrument_is_off_unless_enabled(settings):
+    settings.DOCUMENT_INSTRUMENTATION = False
+    registry.pop('test.off', None)
+    with instrument('test.off'):
+        User.objects.count()
+
+    assert 'test.off' not in registry
+    assert not connection.force_debug_cursor
+
+
+@pytest.mark.django_db
+def test_instrument_logs_only_the_outermost_block(settings, caplog):
+    settings.DOCUMENT_INSTRUMENTATION = True
+    settings.DOCUMENT_SLOW_THRESHOLD = 60
+    with caplog.at_level(logging.INFO, logger='backend.apps.document.instrumentation'):
+        with instrument('test.outer'):
+            for _ in range(3):
+                with instrument('test.inner'):
+                    User.objects.count()
+
+    assert [json.loads(record.getMessage())['name'] for record in caplog.records] == ['test.outer']
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('users,files,logs', [(4, 2, 10), (40, 6, 200)])
+def test_hot_path_query_budgets(users, files, logs, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    assert check_budgets(bench_hot_paths(users=users, files=files, logs=logs)) == []
+
+
+@pytest.mark.django_db
+def test_storage_keeps_one_blob_per_content(settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    owner = User.objects.create(username='owner', email='owner@example.com')
+    first, second, third = [
+        Document.objects.create(name='price list', owner=owner, file=ContentFile(b'%PDF-1.4 prices', name='prices.pdf'))
+        for _ in range(3)
+    ]
+    blobs = glob.glob(os.path.join(str(tmpdir), 'blobs', '*', '*', '*'))
+
+    assert len(blobs) == 1
+    assert len({first.filename, second.filename, third.filename}) == 3
+    assert second.size == len(b'%PDF-1.4 prices')
+    assert Document.objects.get(pk=second.pk).file.read() == b'%PDF-1.4 prices'
+
+    second.delete()
+    Document.all_objects.filter(pk__in=[first.pk, third.pk]).delete()
+    call_command('collect_file_blobs', min_age=0)
+    assert os.path.exists(blobs[0])
+
+    Document.all_objects.filter(pk=second.pk).delete()
+    call_command('collect_file_blobs', min_age=0)
+    assert not os.path.exists(blobs[0])
+    assert not os.path.exists(second.file.path)
+
+
+@pytest.mark.django_db
+def test_upload_metadata_is_extracted_once(settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    document = make_document(0)
+    content = b'%PDF-1.4 ' + b'x' * 100
+    document.file = ContentFile(content, name='report.pdf')
+    document.save()
+
+    assert document.mime_type == 'application/pdf'
+    assert document.file_size == len(content)
+    assert document.checksum == hashlib.sha256(content).hexdigest()
+
+    # A row stored before the metadata existed, whose file is gone, can still be soft deleted.
+    Document.all_objects.filter(pk=document.pk).update(checksum='', file_size=None)
+    os.remove(document.file.path)
+    Document.all_objects.get(pk=document.pk).delete()
+    assert Document.all_objects.get(pk=document.pk).is_delete
+
+
+@pytest.mark.django_db
+def test_download_uses_stored_content_type(settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    document = make_document(1)
+    content = b'%PDF-1.4 ' + b'x' * 100
+    document.file = ContentFile(content, name='report.pdf')
+    document.save()
+    user = document.get_recipients(perm='view_document')[0]
+    token = document.frontend_download_url(user).rsplit('/', 1)[-1]
+
+    response = DocumentDownloadView.as_view()(APIRequestFactory().get('/download/'), token=token)
+
+    assert response['Content-Type'] == 'application/pdf'
+    assert b''.join(response.streaming_content) == content
+
+
+@pytest.mark.django_db
+def test_storage_recreates_a_collected_blob(settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    owner = User.objects.create(username='owner', email='owner@example.com')
+    first = Document.objects.create(name='promotion', owner=owner, file=ContentFile(b'promotion', name='a.pdf'))
+    blob = glob.glob(os.path.join(str(tmpdir), 'blobs', '*', '*', '*'))[0]
+    os.remove(blob)  # collected between the upload being hashed and linked
+
+    second = Document.objects.create(name='promotion', owner=owner, file=ContentFile(b'promotion', name='b.pdf'))
+
+    assert second.checksum == first.checksum
+    assert os.path.exists(blob)
+    assert os.path.samefile(blob, second.file.path)
+    assert not glob.glob(os.path.join(str(tmpdir), 'blobs', '*.upload'))
+
+
+@pytest.mark.django_db
+def test_upload_metadata_recognizes_office_documents(settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w', zipfile.ZIP_STORED) as workbook:
+        # A long first entry pushes the one that tells spreadsheets apart past the first 2KB.
+        workbook.writestr('[Content_Types].xml', '<?xml version="1.0"?><Types>{}</Types>'.format(' ' * 4096))
+        workbook.writestr('_rels/.rels', '<?xml version="1.0"?><Relationships/>')
+        workbook.writestr('xl/workbook.xml', '<?xml version="1.0"?><workbook/>')
+    document = make_document(0)
+    document.file = ContentFile(content.getvalue(), name='prices.xlsx')
+    document.save()
+
+    assert document.mime_type == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def make_token():
+    document = make_document(1)
+    user = document.get_recipients(perm='view_document')[0]
+    token = document.frontend_download_url(user).rsplit('/', 1)[-1]
+    return document, user, SecureToken.objects.get(token=token)
+
+
+@pytest.mark.django_db
+def test_resolve_token_is_cached(django_assert_num_queries):
+    document, user, secure_token = make_token()
+    assert resolve_token(secure_token.token).content_object == document
+
+    with django_assert_num_queries(0):
+        resolved = resolve_token(secure_token.token)
+    assert resolved.user == user
+    assert resolve_token('unknown') is None
+
+
+@pytest.mark.django_db
+def test_resolve_token_checks_the_category():
+    document, user, secure_token = make_token()
+    assert resolve_token(secure_token.token, category='other') is None
+    # The cached entry keeps the category, so it is checked on hits too.
+    assert resolve_token(secure_token.token, category='other') is None
+    assert resolve_token(secure_token.token) is not None
+
+
+@pytest.mark.django_db
+def test_saving_or_deleting_a_token_evicts_it():
+    document, user, secure_token = make_token()
+    resolve_token(secure_token.token)
+
+    secure_token.category = 'other'
+    secure_token.save()
+    assert resolve_token(secure_token.token) is None
+
+    secure_token.category = SecureToken.DOWNLOAD
+    secure_token.save()
+    assert resolve_token(secure_token.token) is not None
+    secure_token.delete()
+    assert resolve_token(secure_token.token) is None
+
+
+@pytest.mark.parametrize('expires_in,expected', [(None, 300), (3600, 300), (30, 30), (-5, 0)])
+def test_token_cache_timeout_stops_at_expiry(settings, expires_in, expected):
+    settings.SECURE_TOKEN_CACHE_TIMEOUT = 300
+    expires_at = None
+    if expires_in is not None:
+        expires_at = timezone.now() + timedelta(seconds=expires_in, milliseconds=500)
+    timeout = cache_timeout(expires_at)
+    if expected:
+        assert timeout == expected
+    else:
+        assert timeout <= 0
+
+
+def test_active_until_follows_the_active_rule():
+    now = timezone.now()
+    created_at = now - timedelta(seconds=20)
+    recent = File.objects.filter(created_at__gt=now - timedelta(seconds=30))
+    undated = File.objects.filter(Q(created_at__isnull=True) | Q(created_at__gt=now))
+
+    assert active_until(File(created_at=created_at), recent.query.where, now) == created_at + timedelta(seconds=30)
+    assert active_until(File(created_at=None), undated.query.where, now) is None
+    assert active_until(File(created_at=now), undated.query.where, now) == now
+    assert active_until(File(), File.objects.filter(name='a').query.where, now) is None
+
+
+@pytest.mark.django_db
+def test_token_expiring_while_cached_is_not_resolved(monkeypatch):
+    document, user, secure_token = make_token()
+    monkeypatch.setattr(tokens, 'active_until', lambda *args: timezone.now() + timedelta(seconds=1))
+    assert resolve_token(secure_token.token) is not None
+
+    time.sleep(1.1)
+    monkeypatch.setattr(SecureToken.objects, 'active', lambda: SecureToken.objects.none())
+    assert resolve_token(secure_token.token) is None
+
+
+@pytest.mark.django_db
+def test_evict_all_drops_tokens_revoked_in_bulk(monkeypatch):
+    document, user, secure_token = make_token()
+    assert resolve_token(secure_token.token) is not None
+
+    monkeypatch.setattr(SecureToken.objects, 'active', lambda: SecureToken.objects.none())
+    assert resolve_token(secure_token.token) is not None
+    tokens.evict_all()
+    assert resolve_token(secure_token.token) is None
+
+
+@pytest.mark.django_db
+def test_retrieve_view_resolves_tokens():
+    document, user, secure_token = make_token()
+    view = DocumentDownloadRetrieveView.as_view()
+
+    response = view(APIRequestFactory().get('/download/'), token=secure_token.token, pk=document.pk)
+    assert response.status_code == 200
+
+    secure_token.delete()
+    response = view(APIRequestFactory().get('/download/'), token=secure_token.token, pk=document.pk)
+    assert response.data == 'invalid token'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_send_reminders_shards_and_resumes(tmpdir, monkeypatch):
+    owner = User.objects.create(username='owner', email='owner@example.com')
+    files = [Document.objects.create(name='document{}'.format(i), owner=owner, notify=True) for i in range(10)]
+    reminded = []
+    monkeypatch.setattr(send_reminders, 'remind', lambda file, send_now: reminded.append(file.pk))
+
+    plan = send_reminders.Command().plan(3)
+    assert plan[0][0] == files[0].pk and plan[-1][1] == files[-1].pk + 1
+    assert all(previous[1] == current[0] for previous, current in zip(plan, plan[1:]))
+
+    checkpoint = str(tmpdir.join('reminders.checkpoint'))
+    send_reminders.write_json(checkpoint + '.0', {'last_pk': files[1].pk, 'files': 2, 'seconds': 1.0})
+    results = [send_reminders.run_shard((shard, start, stop, checkpoint, 2, False))
+               for shard, (start, stop) in enumerate(plan)]
+
+    assert reminded == [file.pk for file in files[2:]]
+    assert sum(result[1] for result in results) == 10
+    assert sum(result[3] for result in results) == 8
+
+
+@pytest.mark.django_db
+def test_reminders_are_queued_for_the_worker():
+    document = make_document(1)
+    send_reminders.remind(document)
+    send_reminders.remind(document)
+
+    jobs = NotificationJob.objects.filter(file=document, status=NotificationJob.PENDING)
+    assert sorted(jobs.values_list('method', 'notify_type')) == [
+        ('notify_owner', ''), ('notify_receiver', document.DOCUMENT_REMINDER),
+    ]
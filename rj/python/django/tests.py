@@ -6,7 +6,11 @@ from django.core.management import call_command
 from django.core.exceptions import ValidationError
 
 from cdo.edu.management.models import (Student, StudentState)
-from cdo.edu.division.models import Division
+from cdo.edu.division.models import Division, DivisionDailyCount
+from cdo.edu.division.occupancy import build_snapshots, count_series
+from backend.apps.document.benchmarks import check_budgets
+from cdo.edu.management.enrollment_benchmarks import QUERY_BUDGETS, bench_enrollment
+from cdo.edu.management.imports import import_states, validate_states
 
 @pytest.fixture(scope='session')
 def django_db_setup(django_db_setup, django_db_blocker):
@@ -29,8 +33,7 @@ def test_division_count(date_check, expected_count):
     StudentState(division=division, parent=student, start_date=start_date, end_date=end_date).save()
     assert division.get_count(date_check) == expected_count
 
-@pytest.mark.django_db
-@pytest.mark.parametrize("start_date,end_date", [
+STUDENT_STATE_CASES = [
     (date(2015, 9, 1), date(2019, 9, 1)),
     (date(2015, 9, 1), date(2016, 9, 2)),
     (date(2015, 9, 1), None),
@@ -40,10 +43,99 @@ def test_division_count(date_check, expected_count):
     pytest.param(date(2015, 9, 1), date(2015, 9, 1), marks=pytest.mark.xfail(raises=ValidationError)),
     pytest.param(date(2015, 9, 2), date(2015, 10, 1), marks=pytest.mark.xfail(raises=ValidationError)),
     pytest.param(date(2015, 9, 1), date(2010, 9, 1), marks=pytest.mark.xfail(raises=ValidationError)),
-])
+]
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("start_date,end_date", STUDENT_STATE_CASES)
 
 def test_student_state(start_date, end_date):
     student = Student.objects.first()
     division = Division.objects.filter(category=None).first()
     student_state = StudentState(start_date=start_date, end_date=end_date, parent=student, division=division)
     student_state.full_clean()
+
+@pytest.mark.django_db
+def test_count_series_matches_get_count(django_assert_num_queries):
+    division = Division.objects.first()
+    student = Student.objects.first()
+    StudentState(division=division, parent=student, start_date=date(2015, 9, 1), end_date=date(2015, 10, 1)).save()
+    StudentState(division=division, parent=student, start_date=date(2015, 11, 1), end_date=None).save()
+    with django_assert_num_queries(1):
+        series = count_series([division], date(2015, 8, 25), date(2015, 11, 5))
+    assert [count for day, count in series[division.pk]] == [division.get_count(day) for day, count in series[division.pk]]
+
+@pytest.mark.django_db
+def test_snapshots_follow_state_changes():
+    division = Division.objects.first()
+    student = Student.objects.first()
+    build_snapshots([division], date(2015, 9, 1), date(2015, 9, 10))
+    state = StudentState(division=division, parent=student, start_date=date(2015, 9, 3), end_date=None)
+    state.save()
+    state.end_date = date(2015, 9, 5)
+    state.save()
+    snapshot = count_series([division], date(2015, 9, 1), date(2015, 9, 10), use_snapshots=True)
+    assert snapshot == count_series([division], date(2015, 9, 1), date(2015, 9, 10))
+    assert DivisionDailyCount.objects.get(division=division, day=date(2015, 9, 4)).count >= 1
+
+@pytest.mark.django_db
+def test_import_states_reports_every_invalid_row(django_assert_max_num_queries):
+    student = Student.objects.first()
+    division = Division.objects.filter(category=None).first()
+    StudentState(division=division, parent=student, start_date=date(2015, 9, 1), end_date=date(2015, 10, 1)).save()
+    rows = [
+        (date(2015, 10, 1), date(2015, 11, 1)),  # valid, adjacent to the saved state
+        (date(2015, 9, 15), date(2015, 9, 20)),  # overlaps the saved state
+        (date(2015, 12, 1), date(2015, 12, 1)),  # empty
+        (date(2016, 9, 1), date(2016, 1, 1)),  # inverted
+        (date(2012, 8, 1), date(2012, 10, 1)),  # before the student stay
+        (date(2016, 1, 1), None),  # valid, open
+        (date(2016, 2, 1), date(2016, 3, 1)),  # overlaps the open row
+    ]
+    states = [StudentState(division=division, parent=student, start_date=start_date, end_date=end_date)
+              for start_date, end_date in rows]
+    with django_assert_max_num_queries(6):
+        created, errors = import_states(states)
+    assert sorted(errors) == [1, 2, 3, 4, 6]
+    assert len(created) == 2
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("start_date,end_date", STUDENT_STATE_CASES)
+def test_import_states_agrees_with_full_clean(start_date, end_date):
+    student = Student.objects.first()
+    division = Division.objects.filter(category=None).first()
+    state = StudentState(start_date=start_date, end_date=end_date, parent=student, division=division)
+    created, errors = import_states([state])
+    if errors:
+        raise ValidationError(errors[0])
+    assert len(created) == 1
+
+@pytest.mark.django_db
+def test_validate_states_rejects_what_full_clean_rejects():
+    student = Student.objects.first()
+    division = Division.objects.filter(category=None).first()
+    for case in STUDENT_STATE_CASES:
+        start_date, end_date = getattr(case, 'values', case)
+        state = StudentState(start_date=start_date, end_date=end_date, parent=student, division=division)
+        try:
+            state.full_clean()
+        except ValidationError:
+            rejected = True
+        else:
+            rejected = False
+        imported = StudentState(start_date=start_date, end_date=end_date, parent_id=student.pk, division=division)
+        assert (0 in validate_states([imported])) == rejected, (start_date, end_date)
+
+@pytest.mark.django_db
+def test_import_states_refreshes_snapshots():
+    division = Division.objects.first()
+    student = Student.objects.first()
+    build_snapshots([division], date(2015, 9, 1), date(2015, 9, 10))
+    state = StudentState(division=division, parent=student, start_date=date(2015, 9, 3), end_date=date(2015, 9, 5))
+    import_states([state])
+    snapshot = count_series([division], date(2015, 9, 1), date(2015, 9, 10), use_snapshots=True)
+    assert snapshot == count_series([division], date(2015, 9, 1), date(2015, 9, 10))
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("per_student", [1, 20])
+def test_enrollment_query_budgets(per_student):
+    assert check_budgets(bench_enrollment(per_student=per_student), QUERY_BUDGETS) == []
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+from collections import namedtuple
+from datetime import datetime
+
+from backend.apps.auth.models import SecureToken
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import models
+from django.db.models.sql.where import OR, WhereNode
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+
+
+class ResolvedToken(namedtuple('ResolvedToken', ['user', 'content_type_id', 'object_id'])):
+
+    @property
+    def content_object(self):
+        content_type = ContentType.objects.get_for_id(self.content_type_id)
+        return content_type.get_object_for_this_type(pk=self.object_id)
+
+
+GENERATION_KEY = 'secure-token-generation'
+
+
+def cache_key(token):
+    return 'secure-token:' + hashlib.md5(force_bytes(token)).hexdigest()
+
+
+def generation():
+    """Current generation of the cached tokens; entries of older generations are ignored."""
+    return cache.get_or_set(GENERATION_KEY, 1, None)
+
+
+def evict_all():
+    """Drop every cached token, for revocations through ``QuerySet.update()`` which send no signals."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 2, None)
+
+
+def active_until(secure_token, where, now):
+    """When ``secure_token`` stops matching the ``where`` clause of ``SecureToken.objects.active()``.
+
+    ``where`` was built at ``now``; a rule ``field > moment`` holds until ``field`` plus the
+    time since ``moment``, so the rule is read from the manager rather than restated here.
+    Returns None when no rule depends on time, and ``now`` for rules it cannot follow.
+    """
+    if isinstance(where, WhereNode):
+        deadlines = [active_until(secure_token, child, now) for child in where.children]
+        limited = [deadline for deadline in deadlines if deadline is not None]
+        if where.negated and limited:
+            return now
+        if where.connector == OR:
+            return None if len(limited) < len(deadlines) else max(limited)
+        return min(limited) if limited else None
+
+    field = getattr(getattr(where, 'lhs', None), 'target', None)
+    if not isinstance(field, models.DateField):
+        return None
+    value = getattr(secure_token, field.attname)
+    if where.lookup_name == 'isnull':
+        return None if (value is None) == bool(where.rhs) else now
+    if where.lookup_name in ('lt', 'lte') and isinstance(where.rhs, datetime):
+        # Starts to match at some point and keeps matching.
+        return None
+    if where.lookup_name in ('gt', 'gte') and isinstance(where.rhs, datetime) and value is not None:
+        return value + (now - where.rhs)
+    return now
+
+
+def cache_timeout(expires_at):
+    """Seconds a token may stay cached: ``SECURE_TOKEN_CACHE_TIMEOUT``, capped by ``expires_at``."""
+    timeout = getattr(settings, 'SECURE_TOKEN_CACHE_TIMEOUT', 300)
+    if expires_at is not None:
+        timeout = min(timeout, int((expires_at - timezone.now()).total_seconds()))
+    return timeout
+
+
+def resolve_token(token, category=SecureToken.DOWNLOAD):
+    """Validate an active ``token`` and return its user and target, or None.
+
+    Valid tokens are cached for ``SECURE_TOKEN_CACHE_TIMEOUT`` seconds, never past the moment
+    ``SecureToken.objects.active()`` stops returning them; saving or deleting the token evicts
+    the entry, and ``evict_all`` drops every entry after a bulk ``update()``.
+    """
+    key, version = cache_key(token), generation()
+    cached = cache.get(key, version=version)
+    if cached is not None:
+        resolved = ResolvedToken(*cached[1:])
+        return resolved if cached[0] == category else None
+
+    now = timezone.now()
+    active = SecureToken.objects.active()
+    try:
+        secure_token = active.select_related('user').get(token=token)
+    except SecureToken.DoesNotExist:
+        return None
+
+    timeout = cache_timeout(active_until(secure_token, active.query.where, now))
+    if timeout > 0:
+        cache.set(key, (secure_token.category, secure_token.user, secure_token.content_type_id,
+                        secure_token.object_id), timeout, version=version)
+    if secure_token.category != category:
+        return None
+    return ResolvedToken(secure_token.user, secure_token.content_type_id, secure_token.object_id)